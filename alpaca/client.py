@@ -1,10 +1,16 @@
 import os
 import asyncio
+import datetime
 import threading
+import time
 import configparser
+from types import SimpleNamespace
 import alpaca_trade_api as tradeapi
 
-from config_20XX import MODE
+from alpaca.rest import AlpacaREST
+from bar_buffer import BarBuffer
+from quote import Quote
+from config_20XX import MODE, ORDER_WAIT_TIMEOUT
 
 # loading configuration file
 config = configparser.ConfigParser()
@@ -12,17 +18,44 @@ config.read('alpaca/config.ini')
 for k in config[MODE]:
     os.environ[k.upper()] = config[MODE][k]
 
+# Order statuses after which Alpaca will not change an order again
+CLOSED_ORDER_STATUSES = {'filled', 'canceled', 'expired', 'rejected', 'replaced', 'done_for_day'}
+
+
+# Field lookup that works on both REST Order entities and stream update dicts
+def _order_field(order, field):
+    return order.get(field) if isinstance(order, dict) else getattr(order, field, None)
+
+
 class TradingClient:
 
-    def __init__(self, symbol):
-        self.symbol = symbol.upper()
+    # One client (one pooled REST session, one stream connection) serves every symbol.
+    # Trading calls go through self.rest, self.api is only used for market data.
+    def __init__(self, symbols):
+        self.symbols = [s.upper() for s in ([symbols] if isinstance(symbols, str) else symbols)]
+        self.symbol = self.symbols[0]
         self.api = tradeapi.REST()
-        self.account = self.api.get_account()
-
-        self.curr_price = self.api.get_last_trade(self.symbol).price
-        quote = self.get_quote()
-        self.ask_price = quote.askprice
-        self.bid_price = quote.bidprice
+        self.rest = AlpacaREST(config[MODE]['APCA_API_BASE_URL'], config[MODE]['APCA_API_KEY_ID'],
+                               config[MODE]['APCA_API_SECRET_KEY'])
+        self.account = self.rest.get_account()
+
+        # Latest Quote per symbol, only ever replaced (by the stream thread), never mutated
+        self.quotes, self.bars = {}, {}
+        for symbol in self.symbols:
+            quote = self.get_quote(symbol)
+            self.quotes[symbol] = Quote(symbol, self.api.get_last_trade(symbol).price, quote.bidprice, quote.askprice,
+                                        timestamp=time.time(), received=time.monotonic())
+            self.bars[symbol] = BarBuffer()
+
+        self.listeners = []
+        self.clock = None
+        self.clock_expiry = None
+
+        # Local order-state table (id -> info), kept current by trade_updates events
+        self.orders = {}
+        self.orders_changed = threading.Condition()
+        for order in self.rest.list_orders(status='open'):
+            self.update_order(order)
 
         self.stream = tradeapi.Stream(config[MODE]['APCA_API_KEY_ID'],
                 config[MODE]['APCA_API_SECRET_KEY'],
@@ -31,15 +64,27 @@ class TradingClient:
 
         async def trade_callback(trade):
             #print(trade)
-            self.curr_price = trade.price
+            self.quotes[trade.symbol] = self.quotes[trade.symbol].with_trade(trade.price, trade.timestamp.timestamp())
+            self.bars[trade.symbol].add_trade(trade.price, trade.size, trade.timestamp.timestamp())
+            for listener in self.listeners:
+                listener(trade.symbol)
 
         async def quote_callback(quote):
             #print(quote)
-            self.bid_price = quote.bid_price
-            self.ask_price = quote.ask_price
+            self.quotes[quote.symbol] = self.quotes[quote.symbol].with_quote(quote.bid_price, quote.ask_price,
+                                                                             quote.timestamp.timestamp())
+            self.bars[quote.symbol].add_quote(quote.bid_price, quote.ask_price, quote.timestamp.timestamp())
+            for listener in self.listeners:
+                listener(quote.symbol)
 
-        self.stream.subscribe_trades(trade_callback, self.symbol)
-        self.stream.subscribe_quotes(quote_callback, self.symbol)
+        async def trade_update_callback(update):
+            info = self.update_order(update.order)
+            for listener in self.listeners:
+                listener(info['symbol'])
+
+        self.stream.subscribe_trades(trade_callback, *self.symbols)
+        self.stream.subscribe_quotes(quote_callback, *self.symbols)
+        self.stream.subscribe_trade_updates(trade_update_callback)
 
         self.stream_event_loop = asyncio.new_event_loop()
         def start_stream():
@@ -54,26 +99,42 @@ class TradingClient:
 
     def halt(self):
         print("Shutting down alpaca client stream...")
-        self.stream.unsubscribe_trades()
-        self.stream.unsubscribe_quotes()
+        self.stream.unsubscribe_trades(*self.symbols)
+        self.stream.unsubscribe_quotes(*self.symbols)
+        self.stream.unsubscribe_trade_updates()
         for task in asyncio.all_tasks(loop=self.stream_event_loop):
             task.cancel()
         self.stream_event_loop.stop()
+        self.rest.close()
+
+    # Call listener(symbol) from the stream thread on every trade, quote and order update
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def get_quote(self, symbol=None):
+        return self.api.get_last_quote(symbol or self.symbol)
+
+    # Consistent last trade and bid/ask, read these from one snapshot rather than the getters below
+    def get_snapshot(self, symbol=None):
+        return self.quotes[symbol or self.symbol]
 
-    def get_quote(self):
-        return self.api.get_last_quote(self.symbol)
+    def get_last_price(self, symbol=None):
+        return self.quotes[symbol or self.symbol].price
 
-    def get_last_price(self):
-        return self.curr_price
+    def get_last_ask(self, symbol=None):
+        return self.quotes[symbol or self.symbol].ask
 
-    def get_last_ask(self):
-        return self.ask_price
+    def get_last_bid(self, symbol=None):
+        return self.quotes[symbol or self.symbol].bid
 
-    def get_last_bid(self):
-        return self.bid_price
+    def seed_bars(self, times, bars, symbol=None):
+        self.bars[symbol or self.symbol].seed(times, bars)
+
+    def get_bar_window(self, symbol=None):
+        return self.bars[symbol or self.symbol].latest_window()
 
     def place_order(self, order):
-        return self.api.submit_order(
+        placed = self.rest.submit_order(
             symbol=order['symbol'].upper(),
             qty=int(order['qty']),
             side=order['action'].lower(),
@@ -81,26 +142,114 @@ class TradingClient:
             limit_price=float(order['limit_price']) if order['price_type'].lower() == 'limit' else None,
             time_in_force='gtc'
         )
-
-    def get_order_info(self, order_id):
-        order = self.get_order(order_id)
-        p = float(order.filled_avg_price) if order.filled_avg_price else 0.0
+        # The stream may already have reported on this order, only record it if not
+        with self.orders_changed:
+            if placed['id'] not in self.orders:
+                self.update_order(placed)
+        return SimpleNamespace(**placed)
+
+    # Submit orders (e.g. one per symbol) concurrently
+    def place_orders(self, orders):
+        return list(self.rest.executor.map(self.place_order, orders))
+
+    # Record an order's state from a REST entity or a trade_updates payload
+    def update_order(self, order):
+        p = _order_field(order, 'filled_avg_price')
         info = {
-            'filled_qty': int(order.filled_qty),
-            'qty': int(order.qty),
-            'avg_price': p,
-            'action': order.side.upper()
+            'filled_qty': int(float(_order_field(order, 'filled_qty') or 0)),
+            'qty': int(float(_order_field(order, 'qty') or 0)),
+            'avg_price': float(p) if p else 0.0,
+            'action': _order_field(order, 'side').upper(),
+            'price_type': (_order_field(order, 'type') or 'market').upper(),
+            'limit_price': float(_order_field(order, 'limit_price') or 0) or None,
+            'symbol': _order_field(order, 'symbol'),
+            'status': _order_field(order, 'status'),
         }
-        return  info
+        with self.orders_changed:
+            prev = self.orders.get(_order_field(order, 'id'))
+            # Events can arrive out of order; never reopen a closed order or unfill shares
+            reopened = prev and prev['status'] in CLOSED_ORDER_STATUSES and info['status'] not in CLOSED_ORDER_STATUSES
+            if reopened or (prev and prev['filled_qty'] > info['filled_qty']):
+                return prev
+            self.orders[_order_field(order, 'id')] = info
+            self.orders_changed.notify_all()
+        return info
 
-    def get_order(self, order_id):
-        return self.api.get_order(order_id)
+    def get_order_info(self, order_id):
+        with self.orders_changed:
+            info = self.orders.get(order_id)
+        if info is None:
+            # Not seen on the stream yet, ask the REST API once
+            info = self.update_order(self.get_order(order_id))
+        return info
+
+    # Load every order (for symbol) submitted since `after` into the order table in one call
+    def sync_orders(self, after=None, symbol=None):
+        for order in self.rest.list_orders(status='all', symbols=[symbol] if symbol else None, after=after):
+            self.update_order(order)
+
+    # {symbol: shares held}, in one call
+    def get_positions(self):
+        return {p['symbol']: int(float(p['qty'])) for p in self.rest.list_positions()}
+
+    # Cash in the account, in one call
+    def get_cash(self):
+        return float(self.rest.get_account()['cash'])
+
+    # {order id: info} of every order the table has open, loaded by list_orders(status='open')
+    # at startup and sync_orders since
+    def get_open_orders(self, symbol=None):
+        with self.orders_changed:
+            return {order_id: dict(info, id=order_id) for order_id, info in self.orders.items()
+                    if info['status'] not in CLOSED_ORDER_STATUSES and (symbol is None or info['symbol'] == symbol)}
 
-    def get_active_order_ids(self):
-        return [order.client_order_id for order in self.api.list_orders()]
+    def get_order(self, order_id):
+        return self.rest.get_order(order_id)
+
+    def get_active_order_ids(self, symbol=None):
+        with self.orders_changed:
+            return [order_id for order_id, info in self.orders.items()
+                    if info['status'] not in CLOSED_ORDER_STATUSES and (symbol is None or info['symbol'] == symbol)]
+
+    def _open_ids(self, order_ids):
+        with self.orders_changed:
+            return [i for i in order_ids if i not in self.orders or self.orders[i]['status'] not in CLOSED_ORDER_STATUSES]
+
+    # Block until the given orders are closed, returns False on timeout
+    def wait_orders_closed(self, order_ids, timeout=ORDER_WAIT_TIMEOUT):
+        with self.orders_changed:
+            closed = self.orders_changed.wait_for(lambda: not self._open_ids(order_ids), timeout)
+        if not closed:
+            # Fall back to REST in case an update was missed
+            for order_id in self._open_ids(order_ids):
+                self.update_order(self.get_order(order_id))
+            closed = not self._open_ids(order_ids)
+        return closed
 
     def cancel_order(self, order_id):
-        return self.api.cancel_order(order_id)
+        return self.rest.cancel_order(order_id)
+
+    # Cancel the given orders concurrently. Callers pass their own order ids, so orders on
+    # the same symbol placed by anyone else (another process, by hand) are left alone.
+    def cancel_orders(self, order_ids):
+        order_ids = list(order_ids)
+        self.rest.cancel_orders(order_ids)
+        return order_ids
+
+    # Wall clock used by Trader for its prediction schedule
+    def now(self):
+        return datetime.datetime.now()
 
+    # The clock is cached until the next open/close, so this is only a REST call at session boundaries
     def market_is_open(self):
-        return self.api.get_clock().is_open
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if self.clock is None or now >= self.clock_expiry:
+            self.clock = self.rest.get_clock()
+            self.clock_expiry = self.clock.next_close if self.clock.is_open else self.clock.next_open
+        return self.clock.is_open
+
+    # Seconds until the market next opens or closes
+    def seconds_to_market_change(self):
+        self.market_is_open()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max((self.clock_expiry - now).total_seconds(), 0.0)
@@ -0,0 +1,212 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config_20XX import ALPACA_RATE_LIMIT, ALPACA_BURST, ALPACA_POOL_SIZE, ALPACA_TIMEOUT, ALPACA_RETRIES
+
+
+# Reads and cancels are safe to retry, order submission is not
+RETRY_METHODS = ('GET', 'DELETE')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF = 0.25
+
+
+# Token bucket shared by every thread using one account's REST quota
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Block until a request may be made
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def _parse_time(s):
+    return datetime.datetime.fromisoformat(s.replace('Z', '+00:00'))
+
+
+# Trading API (orders, positions, clock) over one pooled keep-alive session.
+# Responses are plain dicts; base_url can point at a mock server.
+class AlpacaREST:
+
+    def __init__(self, base_url, key_id, secret_key, rate_limit=ALPACA_RATE_LIMIT, burst=ALPACA_BURST,
+                 pool_size=ALPACA_POOL_SIZE, timeout=ALPACA_TIMEOUT, retries=ALPACA_RETRIES):
+        self.base_url = base_url.rstrip('/') + '/v2'
+        self.timeout = timeout
+        self.retries = retries
+        self.bucket = TokenBucket(rate_limit / 60, burst)
+
+        self.session = requests.Session()
+        self.session.headers.update({'APCA-API-KEY-ID': key_id, 'APCA-API-SECRET-KEY': secret_key})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    # Every attempt, retries included, takes a token from the bucket so retries can not
+    # push the account over its quota
+    def request(self, method, path, params=None, json=None):
+        retries = self.retries if method in RETRY_METHODS else 0
+        for attempt in range(retries + 1):
+            self.bucket.acquire()
+            try:
+                resp = self.session.request(method, self.base_url + path, params=params, json=json, timeout=self.timeout)
+            except requests.ConnectionError:
+                if attempt == retries:
+                    raise
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+            if resp.status_code in RETRY_STATUSES and attempt < retries:
+                retry_after = resp.headers.get('Retry-After')
+                time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else RETRY_BACKOFF * 2 ** attempt)
+                continue
+            resp.raise_for_status()
+            return resp.json() if resp.content else None
+
+    def get_account(self):
+        return self.request('GET', '/account')
+
+    def get_clock(self):
+        clock = self.request('GET', '/clock')
+        return SimpleNamespace(is_open=clock['is_open'], timestamp=_parse_time(clock['timestamp']),
+                               next_open=_parse_time(clock['next_open']), next_close=_parse_time(clock['next_close']))
+
+    def list_positions(self):
+        return self.request('GET', '/positions')
+
+    def list_orders(self, status='open', symbols=None, after=None, limit=500):
+        params = {'status': status, 'limit': limit}
+        if symbols:
+            params['symbols'] = ','.join(symbols)
+        if after:
+            params['after'] = after.isoformat()
+        return self.request('GET', '/orders', params=params)
+
+    def get_order(self, order_id):
+        return self.request('GET', '/orders/%s' % order_id)
+
+    def submit_order(self, **order):
+        return self.request('POST', '/orders', json={k: v for k, v in order.items() if v is not None})
+
+    # Submit several orders at once (e.g. one per symbol), results in the same order
+    def submit_orders(self, orders):
+        return list(self.executor.map(lambda order: self.submit_order(**order), orders))
+
+    def cancel_order(self, order_id):
+        return self.request('DELETE', '/orders/%s' % order_id)
+
+    def _cancel_if_open(self, order_id):
+        try:
+            return self.cancel_order(order_id)
+        except requests.HTTPError as e:
+            # The order filled or closed before the cancel arrived
+            if e.response is not None and e.response.status_code in (404, 422):
+                return None
+            raise
+
+    # Cancel the given orders concurrently, or every open order in one call if none are given
+    def cancel_orders(self, order_ids=None):
+        if order_ids is None:
+            return self.request('DELETE', '/orders')
+        return list(self.executor.map(self._cancel_if_open, order_ids))
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+
+# Run `python3 -m alpaca.rest` to exercise the client against a local mock of the trading API
+if __name__ == '__main__':
+    import http.server
+    import itertools
+    import json
+
+    class MockAlpaca(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        orders, ids, connections = {}, itertools.count(1), set()
+        requests_seen, fail_next = 0, 0
+
+        def reply(self, status, body=None):
+            data = json.dumps(body).encode() if body is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.connections.add(self.client_address)
+            MockAlpaca.requests_seen += 1
+            if MockAlpaca.fail_next:
+                MockAlpaca.fail_next -= 1
+                self.reply(503, {'message': 'unavailable'})
+            elif self.path.startswith('/v2/clock'):
+                self.reply(200, {'is_open': True, 'timestamp': '2024-01-02T10:00:00-05:00',
+                                 'next_open': '2024-01-03T09:30:00-05:00', 'next_close': '2024-01-02T16:00:00-05:00'})
+            elif self.path.startswith('/v2/orders'):
+                self.reply(200, [o for o in self.orders.values() if o['status'] == 'new'])
+            else:
+                self.reply(404, {})
+
+        def do_POST(self):
+            self.connections.add(self.client_address)
+            order = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            order.update(id=str(next(self.ids)), status='new', filled_qty='0', filled_avg_price=None)
+            self.orders[order['id']] = order
+            self.reply(200, order)
+
+        def do_DELETE(self):
+            self.connections.add(self.client_address)
+            order = self.orders.get(self.path.split('/')[-1])
+            if order is None or order['status'] != 'new':
+                self.reply(422, {'message': 'order is not cancelable'})
+                return
+            order['status'] = 'canceled'
+            self.reply(204)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockAlpaca)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rest = AlpacaREST('http://127.0.0.1:%d' % server.server_port, 'key', 'secret', rate_limit=600, burst=5)
+
+    print("clock open:", rest.get_clock().is_open)
+    orders = [dict(symbol=s, qty=1, side='buy', type='market', time_in_force='gtc') for s in ['AMC', 'GME', 'BB', 'NOK']]
+    placed = rest.submit_orders(orders)
+    print("submitted:", [(o['id'], o['symbol']) for o in placed])
+    print("open orders:", len(rest.list_orders()))
+    rest.cancel_orders([o['id'] for o in placed] + ['999'])
+    print("open after bulk cancel:", len(rest.list_orders()))
+
+    start = time.perf_counter()
+    for _ in range(30):
+        rest.get_clock()
+    print("rate limited to %.1f requests/s (limit 10/s)" % (30 / (time.perf_counter() - start)))
+    print("connections opened for 44 requests:", len({port for _, port in MockAlpaca.connections}))
+
+    # Two 503s then a success, every attempt is paid for from the bucket
+    MockAlpaca.requests_seen, MockAlpaca.fail_next = 0, 2
+    acquired, acquire = [], rest.bucket.acquire
+    rest.bucket.acquire = lambda: (acquired.append(1), acquire())
+    print("clock open after 2 retries:", rest.get_clock().is_open, "- attempts: %d, tokens taken: %d" % (MockAlpaca.requests_seen, len(acquired)))
+    rest.close()
+    server.shutdown()
@@ -0,0 +1,112 @@
+import asyncio
+import concurrent.futures
+import datetime
+import pytz
+import time
+
+from latency import METRICS
+
+from config_20XX import *
+
+
+
+class TraderValidationError(Exception):
+	pass
+
+
+# Event-driven alternative to Trader.trading_loop. Trades and quotes from the
+# client stream wake the trader for that symbol straight away; a timer task
+# covers predictions and fill checks when the stream is quiet, and the market
+# clock is only refreshed at session boundaries.
+class AsyncTradingEngine:
+
+	def __init__(self, traders, client, min_tick_interval=ASYNC_MIN_TICK_INTERVAL):
+		self.traders = {trader.stock_ticker: trader for trader in traders}
+		self.client = client
+		self.min_tick_interval = min_tick_interval
+
+		self.loop = None
+		self.wakeups = {}
+		self.first_event = {}
+		self.market_open = False
+
+		# Trader code (model + REST) runs on one worker thread, in order, so the
+		# event loop never blocks and traders sharing a model or cash never overlap
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+	# Called on the stream thread
+	def on_stream_event(self, symbol):
+		if self.loop is None or symbol not in self.traders:
+			return
+		self.first_event.setdefault(symbol, time.perf_counter())
+		try:
+			self.loop.call_soon_threadsafe(self.wakeups[symbol].set)
+		except RuntimeError:
+			# Loop closed between the check and the call
+			pass
+
+	async def symbol_task(self, trader):
+		wakeup = self.wakeups[trader.stock_ticker]
+		while True:
+			await wakeup.wait()
+			wakeup.clear()
+			event_time = self.first_event.pop(trader.stock_ticker, None)
+			if not self.market_open:
+				continue
+
+			ok = await self.loop.run_in_executor(self.executor, lambda: trader.tick(*trader.get_prices()))
+			if not ok:
+				raise TraderValidationError(trader.stock_ticker)
+			if event_time is not None:
+				METRICS.record('event_to_decision', time.perf_counter() - event_time)
+			await asyncio.sleep(self.min_tick_interval)
+
+	async def timer_task(self):
+		while True:
+			await asyncio.sleep(TRADING_HOURS_SLEEP)
+			METRICS.maybe_export()
+			for wakeup in self.wakeups.values():
+				wakeup.set()
+
+	async def clock_task(self):
+		tz = pytz.timezone('US/Eastern')
+		while True:
+			self.market_open = await self.loop.run_in_executor(None, self.client.market_is_open)
+			state = "OPEN" if self.market_open else "CLOSED - NO ACTION"
+			print("\n---\n%s  MARKET %s" % (datetime.datetime.now(tz).strftime("%H:%M:%S,  %m/%d/%Y"), state))
+			# Sleep to the next open/close, with a short margin so the cached clock has expired
+			await asyncio.sleep(self.client.seconds_to_market_change() + 1)
+
+	async def main(self):
+		self.loop = asyncio.get_running_loop()
+		self.wakeups = {symbol: asyncio.Event() for symbol in self.traders}
+		tasks = [self.clock_task(), self.timer_task()]
+		tasks += [self.symbol_task(trader) for trader in self.traders.values()]
+		await asyncio.gather(*tasks)
+
+	def run(self):
+		self.client.add_listener(self.on_stream_event)
+		while (1):
+			try:
+				asyncio.run(self.main())
+			except KeyboardInterrupt:
+				self.loop = None
+				self.trading_summary()
+				if self.prompt_quit():
+					break
+			except TraderValidationError:
+				self.loop = None
+				if self.prompt_quit():
+					break
+
+	def prompt_quit(self):
+		trader = next(iter(self.traders.values()))
+		if trader.prompt_quit():
+			self.executor.shutdown()
+			return True
+		return False
+
+	def trading_summary(self):
+		for trader in self.traders.values():
+			trader.trading_summary(self.client.get_last_price(trader.stock_ticker))
+		METRICS.summary()
@@ -0,0 +1,223 @@
+import contextlib
+import datetime
+import itertools
+import os
+import sys
+import time
+import types
+import numpy as np
+
+from features import compute_features
+from order import *
+from quote import Quote
+from trader import *
+
+from config_20XX import *
+
+
+
+# Stands in for alpaca.client.TradingClient, replaying stored bars one at a time.
+# Bid/ask are the bar close -/+ half the spread; market orders fill at once on the
+# bid/ask, resting limit orders fill at their limit once a bar's range crosses it.
+class SimulatedTradingClient:
+
+	def __init__(self, symbol, times, bars, spread=BACKTEST_SPREAD):
+		self.symbol = symbol.upper()
+		self.times = times
+		self.bars = np.asarray(bars, dtype=np.float64)
+		self.features = compute_features(self.bars)
+		self.half_spread = spread / 2
+		self.i = -1
+
+		self.ids = itertools.count(1)
+		self.orders = {}
+		self.fills = 0
+
+	def __len__(self):
+		return len(self.times)
+
+	# Advance to bar i and fill resting limit orders against its range
+	def step(self, i):
+		self.i = i
+		bid_high = float(self.bars[i, 1]) - self.half_spread
+		ask_low = float(self.bars[i, 2]) + self.half_spread
+		for order_id, order in self.orders.items():
+			if order['status'] != 'open' or order['price_type'] != 'LIMIT':
+				continue
+			if order['action'] == 'SELL' and bid_high >= order['limit_price']:
+				self._fill(order, order['limit_price'])
+			elif order['action'] == 'BUY' and ask_low <= order['limit_price']:
+				self._fill(order, order['limit_price'])
+
+	def _fill(self, order, price):
+		order['filled_qty'] = order['qty']
+		order['avg_price'] = price
+		order['status'] = 'filled'
+		self.fills += 1
+
+	def now(self):
+		return datetime.datetime.fromtimestamp(int(self.times[self.i]), datetime.timezone.utc)
+
+	def halt(self):
+		pass
+
+	def market_is_open(self):
+		return True
+
+	def get_last_price(self, symbol=None):
+		return float(self.bars[self.i, 3])
+
+	def get_last_ask(self, symbol=None):
+		return round(float(self.bars[self.i, 3]) + self.half_spread, 4)
+
+	def get_last_bid(self, symbol=None):
+		return round(float(self.bars[self.i, 3]) - self.half_spread, 4)
+
+	def get_snapshot(self, symbol=None):
+		return Quote(self.symbol, self.get_last_price(), self.get_last_bid(), self.get_last_ask(), seq=self.i,
+					timestamp=float(self.times[self.i]), received=time.monotonic())
+
+	def get_bar_window(self, symbol=None):
+		if self.i + 1 < POINTS_PER_PERIOD:
+			return None
+		return self.features[None, self.i + 1 - POINTS_PER_PERIOD:self.i + 1]
+
+	def place_order(self, order):
+		order = dict(order, filled_qty=0, avg_price=0.0, status='open')
+		order_id = next(self.ids)
+		self.orders[order_id] = order
+		bid, ask = self.get_last_bid(), self.get_last_ask()
+		if order['price_type'] == 'MARKET':
+			self._fill(order, ask if order['action'] == 'BUY' else bid)
+		elif order['action'] == 'SELL' and bid >= order['limit_price']:
+			self._fill(order, bid)
+		elif order['action'] == 'BUY' and ask <= order['limit_price']:
+			self._fill(order, ask)
+		return types.SimpleNamespace(id=order_id)
+
+	def get_order_info(self, order_id):
+		return self.orders[order_id]
+
+	def get_active_order_ids(self, symbol=None):
+		return [order_id for order_id, order in self.orders.items() if order['status'] == 'open']
+
+	def wait_orders_closed(self, order_ids, timeout=None):
+		return True
+
+	def cancel_order(self, order_id):
+		if self.orders[order_id]['status'] == 'open':
+			self.orders[order_id]['status'] = 'canceled'
+
+	def cancel_orders(self, order_ids):
+		for order_id in order_ids:
+			self.cancel_order(order_id)
+		return order_ids
+
+
+
+# Model predictions for the window ending at every bar, from one batched predict call.
+# Bar i's window is row i - POINTS_PER_PERIOD + 1.
+class PredictionTable:
+
+	def __init__(self, model, bars, batch_size=PREDICT_BATCH_SIZE):
+		self.stock_raw = np.ascontiguousarray(sliding_windows(compute_features(bars)), dtype=DTYPE)
+		stock_dat = normalize_data(np.array(self.stock_raw, copy=True), [[0]])
+		self.predictions = make_predictor(model).predict(stock_dat, batch_size=batch_size)
+
+	def __len__(self):
+		return len(self.predictions)
+
+	# Unnormalized price targets for every window, the same arithmetic as Trader.get_stock_prediction
+	def prices(self, conservative_const=CONSERVATIVE_CONST):
+		stock_predict = self.predictions * conservative_const
+		return unnormalize_data(self.stock_raw, stock_predict, [[0]])[0]
+
+
+
+# Trader that looks its predictions up instead of calling the model
+class BacktestTrader(Trader):
+
+	def __init__(self, stock_ticker, model, client, init_cash=1000.00, account=None, prediction_prices=None):
+		super().__init__(stock_ticker, model, client, init_cash, account)
+		self.prediction_prices = prediction_prices
+
+	# The model is never called, so there is nothing to export
+	def set_model(self, model, predictor=None):
+		self.model = model
+		self.predictor = predictor
+
+	def get_stock_prediction(self):
+		return round(float(self.prediction_prices[self.client.i - POINTS_PER_PERIOD + 1][0]), 2)
+
+
+
+# Replay bars through a Trader, returns a summary of the run. With a PredictionTable
+# the model is never called inside the loop.
+def run_backtest(stock_ticker, model, times, bars, init_cash=INIT_CASH,
+				conservative_const=CONSERVATIVE_CONST, prediction_interval=PREDICTION_INTERVAL,
+				predictions=None, verbose=False):
+	client = SimulatedTradingClient(stock_ticker, times, bars)
+	client.step(0)
+	if predictions is None:
+		trader = Trader(stock_ticker, model, client, init_cash)
+	else:
+		trader = BacktestTrader(stock_ticker, model, client, init_cash, prediction_prices=predictions.prices(conservative_const))
+	trader.conservative_const = conservative_const
+	trader.prediction_interval = datetime.timedelta(seconds=prediction_interval)
+
+	start = time.perf_counter()
+	with contextlib.ExitStack() as stack:
+		if not verbose:
+			stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+		for i in range(POINTS_PER_PERIOD - 1, len(client)):
+			client.step(i)
+			if not trader.tick(*trader.get_prices()):
+				break
+	elapsed = time.perf_counter() - start
+
+	value = trader.cash + trader.shares * client.get_last_price()
+	return {
+		'ticker': stock_ticker,
+		'conservative_const': conservative_const,
+		'prediction_interval': prediction_interval,
+		'bars': len(client),
+		'fills': client.fills,
+		'shares': trader.shares,
+		'cash': trader.cash,
+		'value': value,
+		'return': (value / init_cash - 1) * 100,
+		'seconds': elapsed,
+	}
+
+
+# Run every (CONSERVATIVE_CONST, PREDICTION_INTERVAL) combination over the same bars,
+# predicting every window once up front
+def sweep(stock_ticker, model, times, bars, conservative_consts, prediction_intervals, **kwargs):
+	predictions = PredictionTable(model, bars)
+	return [run_backtest(stock_ticker, model, times, bars, conservative_const=c, prediction_interval=p,
+						predictions=predictions, **kwargs)
+			for c, p in itertools.product(conservative_consts, prediction_intervals)]
+
+
+def print_results(results):
+	print("%-6s %6s %8s %8s %6s %12s %9s %8s" % ("TICKER", "CONST", "INTERVAL", "BARS", "FILLS", "VALUE", "RETURN", "SECONDS"))
+	for r in results:
+		print("%-6s %6.2f %8d %8d %6d %12.2f %8.2f%% %8.3f" % (r['ticker'], r['conservative_const'], r['prediction_interval'],
+			r['bars'], r['fills'], r['value'], r['return'], r['seconds']))
+
+
+
+# Run `python3 backtest.py TICKER MODEL_PATH` to replay the stored bars for TICKER
+if __name__ == '__main__':
+	if len(sys.argv) < 3:
+		print('ERROR: Need to specify a ticker and a saved model')
+		exit(1)
+
+	from model_registry import backend
+
+	stock_ticker = sys.argv[1].upper()
+	model = backend().load_model(sys.argv[2])
+
+	times, bars = BarStore().read(stock_ticker)
+	results = sweep(stock_ticker, model, times, bars, BACKTEST_CONSERVATIVE_CONSTS, BACKTEST_PREDICTION_INTERVALS)
+	print_results(results)
@@ -0,0 +1,133 @@
+import threading
+import numpy as np
+
+from config_20XX import *
+from features import FeatureEngine
+
+
+
+# Fixed-size ring buffer of OHLCV bars built from streamed trades and quotes.
+# Quotes only shape a bar (at the mid price) until its first trade arrives.
+# Features are committed bar by bar as each one completes, the bar still forming is
+# only peeked at, so a window costs O(NUM_FEATURES) instead of recomputing history.
+class BarBuffer:
+
+    def __init__(self, capacity=BAR_BUFFER_SIZE, interval=INTERVAL_SECONDS):
+        assert capacity >= POINTS_PER_PERIOD
+        self.capacity = capacity
+        self.interval = interval
+
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.bars = np.zeros((capacity, len(BAR_COLUMNS)), dtype=np.float64)
+        self.count = 0
+        self.traded = False
+
+        self.engine = FeatureEngine()
+        self.features = np.zeros((capacity, NUM_FEATURES), dtype=np.float64)
+        self.committed = 0 # Bars whose features are in self.features, all but the current one
+
+        self.window = np.zeros((1, POINTS_PER_PERIOD, NUM_FEATURES), dtype=DTYPE)
+        self.offsets = np.arange(-POINTS_PER_PERIOD, 0)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def ready(self):
+        return self.count >= POINTS_PER_PERIOD
+
+    # Advance the features over every bar before bar n
+    def _commit(self, n):
+        while self.committed < n:
+            i = self.committed % self.capacity
+            self.features[i] = self.engine.update(self.bars[i])
+            self.committed += 1
+
+    def _open_bar(self, t, price, volume):
+        self._commit(self.count)
+        i = self.count % self.capacity
+        self.times[i] = t
+        self.bars[i] = (price, price, price, price, volume)
+        self.count += 1
+
+    # Index of the bar for time t, or None if t is older than the current bar
+    def _current(self, t):
+        if self.count == 0:
+            return None
+        i = (self.count - 1) % self.capacity
+        return i if self.times[i] == t else None
+
+    def add_trade(self, price, size, timestamp):
+        t = int(timestamp // self.interval) * self.interval
+        with self.lock:
+            if self.count and t < self.times[(self.count - 1) % self.capacity]:
+                return
+            i = self._current(t)
+            if i is None or not self.traded:
+                if i is None:
+                    self._open_bar(t, price, size)
+                else:
+                    self.bars[i] = (price, price, price, price, size)
+                self.traded = True
+                return
+            bar = self.bars[i]
+            bar[1] = max(bar[1], price)
+            bar[2] = min(bar[2], price)
+            bar[3] = price
+            bar[4] += size
+
+    def add_quote(self, bid_price, ask_price, timestamp):
+        if bid_price <= 0 or ask_price <= 0:
+            return
+        mid = (bid_price + ask_price) / 2
+        t = int(timestamp // self.interval) * self.interval
+        with self.lock:
+            if self.count and t < self.times[(self.count - 1) % self.capacity]:
+                return
+            i = self._current(t)
+            if i is None:
+                self._open_bar(t, mid, 0.0)
+                self.traded = False
+            elif not self.traded:
+                bar = self.bars[i]
+                bar[1] = max(bar[1], mid)
+                bar[2] = min(bar[2], mid)
+                bar[3] = mid
+
+    # Load completed bars (e.g. from the BarStore) so the buffer is warm. Bars the buffer
+    # already has win and the history fills in around them, so seeding again after a bar
+    # store update fills the gap between the old store and the stream.
+    def seed(self, times, bars):
+        times, bars = np.asarray(times), np.asarray(bars)
+        with self.lock:
+            traded = self.traded if self.count else True
+            if self.count:
+                n = len(self)
+                held = (self.count - n + np.arange(n)) % self.capacity
+                new = ~np.isin(times, self.times[held])
+                times = np.concatenate([times[new], self.times[held]])
+                bars = np.concatenate([bars[new], self.bars[held]])
+                order = np.argsort(times, kind='stable')
+                times, bars = times[order], bars[order]
+                self.count = self.committed = 0
+                self.engine = FeatureEngine()
+            times, bars = times[-self.capacity:], bars[-self.capacity:]
+            for t, bar in zip(times, bars):
+                self._commit(self.count)
+                i = self.count % self.capacity
+                self.times[i] = t
+                self.bars[i] = bar
+                self.count += 1
+            self.traded = traded
+
+    # Features of the latest POINTS_PER_PERIOD bars (current one included) as a
+    # (1, POINTS_PER_PERIOD, NUM_FEATURES) window. The preallocated array is reused on
+    # every call, copy it to keep it.
+    def latest_window(self):
+        with self.lock:
+            if not self.ready():
+                return None
+            idx = (self.count + self.offsets[:-1]) % self.capacity
+            np.take(self.features, idx, axis=0, out=self.window[0, :-1])
+            self.engine.peek(self.bars[(self.count - 1) % self.capacity], out=self.window[0, -1])
+        return self.window
@@ -0,0 +1,308 @@
+import abc
+import datetime
+import os
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+
+from config_20XX import *
+from bar_store import BarStore
+
+
+
+def _empty_bars():
+    return np.zeros(0, dtype=np.int64), np.zeros((0, len(BAR_COLUMNS)))
+
+
+# Raised by the live path when no provider answered, failed or timed out alike
+class ProviderError(Exception):
+    pass
+
+
+# Source of historical bars. fetch() returns (times, bars) in [start, end) with int64
+# epoch second open times and len(BAR_COLUMNS) wide float64 rows, like BarStore.read
+class BarProvider(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def fetch(self, stock_ticker, start, end):
+        pass
+
+    # The last n bars, the one still forming included
+    def recent(self, stock_ticker, n):
+        end = datetime.datetime.now(datetime.timezone.utc)
+        # Reach back over a weekend so there are bars outside trading hours too
+        start = end - datetime.timedelta(days=4, seconds=n * INTERVAL_SECONDS)
+        times, bars = self.fetch(stock_ticker, start, end + datetime.timedelta(seconds=INTERVAL_SECONDS))
+        return times[-n:], bars[-n:]
+
+
+class YFinanceProvider(BarProvider):
+    name = 'YFINANCE'
+
+    def _to_bars(self, stock_df):
+        if not len(stock_df):
+            return _empty_bars()
+        index = stock_df.index.tz_convert(None) if stock_df.index.tz else stock_df.index
+        return index.values.astype('datetime64[s]').astype(np.int64), stock_df[BAR_COLUMNS].to_numpy(dtype=np.float64)
+
+    # 7 days per request, the most yfinance serves at 1m
+    def fetch(self, stock_ticker, start, end):
+        import yfinance as yf
+        stock = yf.Ticker(stock_ticker)
+        times, bars = [], []
+
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(chunk_start + datetime.timedelta(days=7), end)
+            chunk_times, chunk_bars = self._to_bars(stock.history(interval=INTERVAL, start=chunk_start, end=chunk_end))
+            times.append(chunk_times)
+            bars.append(chunk_bars)
+            chunk_start = chunk_end
+
+        if not times:
+            return _empty_bars()
+        return np.concatenate(times), np.concatenate(bars)
+
+    def recent(self, stock_ticker, n):
+        import yfinance as yf
+        period = str(n * INTERVAL_UNITS) + UNITS
+        times, bars = self._to_bars(yf.Ticker(stock_ticker).history(period=period, interval=INTERVAL))
+        return times[-n:], bars[-n:]
+
+
+class AlpacaProvider(BarProvider):
+    name = 'ALPACA'
+
+    def __init__(self):
+        # Importing the client loads the API keys from alpaca/config.ini into the environment
+        from alpaca.client import tradeapi
+        from alpaca_trade_api.rest import TimeFrame, TimeFrameUnit
+        self.api = tradeapi.REST()
+        unit = {'m': TimeFrameUnit.Minute, 'h': TimeFrameUnit.Hour, 'd': TimeFrameUnit.Day}[UNITS]
+        self.timeframe = TimeFrame(INTERVAL_UNITS, unit)
+
+    def fetch(self, stock_ticker, start, end):
+        stock_df = self.api.get_bars(stock_ticker, self.timeframe, start.isoformat(), end.isoformat(), adjustment='raw').df
+        if not len(stock_df):
+            return _empty_bars()
+        index = stock_df.index.tz_convert(None) if stock_df.index.tz else stock_df.index
+        columns = [c.lower() for c in BAR_COLUMNS]
+        times = index.values.astype('datetime64[s]').astype(np.int64)
+        keep = times < end.timestamp()
+        return times[keep], stock_df[columns].to_numpy(dtype=np.float64)[keep]
+
+
+# Bars from the local BarStore only, for running offline. With a clock (a function
+# returning epoch seconds) it replays the store as if that were the current time.
+class LocalProvider(BarProvider):
+    name = 'LOCAL'
+
+    def __init__(self, store=None, clock=None):
+        self.store = store if store else BarStore()
+        self.clock = clock
+
+    def fetch(self, stock_ticker, start, end):
+        if self.clock:
+            end = min(end, datetime.datetime.fromtimestamp(self.clock() + INTERVAL_SECONDS, datetime.timezone.utc))
+        times, bars = self.store.read(stock_ticker, start=start, end=end)
+        return np.array(times), np.array(bars)
+
+    def recent(self, stock_ticker, n):
+        end = None
+        if self.clock:
+            end = datetime.datetime.fromtimestamp(self.clock() + INTERVAL_SECONDS, datetime.timezone.utc)
+        times, bars = self.store.read(stock_ticker, end=end)
+        return np.array(times[-n:]), np.array(bars[-n:])
+
+
+# Saves every fetch() response of another provider under root, to replay offline later
+class RecordingProvider(BarProvider):
+
+    def __init__(self, provider, root=BAR_RECORD_DIR):
+        self.provider = provider
+        self.name = provider.name
+        self.root = root
+
+    def fetch(self, stock_ticker, start, end):
+        times, bars = self.provider.fetch(stock_ticker, start, end)
+        os.makedirs(self.root, exist_ok=True)
+        path = _record_path(self.root, stock_ticker, start, end)
+        np.savez(path + '.tmp.npz', times=times, bars=bars)
+        os.replace(path + '.tmp.npz', path)
+        return times, bars
+
+
+# Answers fetch() from the responses a RecordingProvider saved, FileNotFoundError for
+# a request that was never recorded
+class ReplayProvider(BarProvider):
+    name = 'REPLAY'
+
+    def __init__(self, root=BAR_RECORD_DIR):
+        self.root = root
+
+    def fetch(self, stock_ticker, start, end):
+        with np.load(_record_path(self.root, stock_ticker, start, end)) as recorded:
+            return recorded['times'], recorded['bars']
+
+
+def _record_path(root, stock_ticker, start, end):
+    return os.path.join(root, "%s_%d_%d.npz" % (stock_ticker, start.timestamp(), end.timestamp()))
+
+
+# Concurrent identical requests share the one call already in flight
+class CoalescingProvider(BarProvider):
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.name = provider.name
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def _call(self, key, fn, *args):
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return future.result()
+
+    def fetch(self, stock_ticker, start, end):
+        return self._call(('fetch', stock_ticker, start, end), self.provider.fetch, stock_ticker, start, end)
+
+    def recent(self, stock_ticker, n):
+        return self._call(('recent', stock_ticker, n), self.provider.recent, stock_ticker, n)
+
+
+# Calls the first provider and, if it has not answered within hedge_after seconds (or
+# failed), the next one too; the first answer wins. Raises ProviderError if every
+# provider failed or none answered within timeout.
+class HedgedProvider(BarProvider):
+
+    def __init__(self, providers, timeout=BAR_TIMEOUT, hedge_after=BAR_HEDGE_AFTER):
+        self.providers = providers
+        self.name = '/'.join(p.name for p in providers)
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        # Calls that time out keep their thread until they return, leave room for them
+        self.executor = ThreadPoolExecutor(max_workers=4 * len(providers))
+
+    def _call(self, method, *args):
+        deadline = time.monotonic() + self.timeout
+        remaining = list(self.providers)
+        pending, error = set(), None
+        while remaining or pending:
+            if remaining:
+                pending.add(self.executor.submit(getattr(remaining.pop(0), method), *args))
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            # Give the calls in flight hedge_after seconds before adding the next provider
+            done, pending = wait(pending, timeout=min(self.hedge_after, left) if remaining else left,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+
+        if error is not None and not pending:
+            raise ProviderError("No bars from %s: %r" % (self.name, error)) from error
+        raise ProviderError("No bars from %s within %.1fs" % (self.name, self.timeout))
+
+    def fetch(self, stock_ticker, start, end):
+        return self._call('fetch', stock_ticker, start, end)
+
+    def recent(self, stock_ticker, n):
+        return self._call('recent', stock_ticker, n)
+
+
+PROVIDERS = {'YFINANCE': YFinanceProvider, 'ALPACA': AlpacaProvider, 'LOCAL': LocalProvider, 'REPLAY': ReplayProvider}
+_providers = {}
+_lock = threading.Lock()
+
+
+def _provider(name):
+    with _lock:
+        if name not in _providers:
+            _providers[name] = CoalescingProvider(PROVIDERS[name]())
+        return _providers[name]
+
+
+# Provider for history (training data, bar store updates)
+def history_provider():
+    return _provider(BAR_PROVIDER)
+
+
+# Provider for the live path: per-call timeout, hedged against the fallback source
+def live_provider():
+    with _lock:
+        if 'LIVE' in _providers:
+            return _providers['LIVE']
+    providers = [_provider(BAR_PROVIDER)]
+    if BAR_FALLBACK_PROVIDER and BAR_FALLBACK_PROVIDER != BAR_PROVIDER:
+        providers.append(_provider(BAR_FALLBACK_PROVIDER))
+    with _lock:
+        return _providers.setdefault('LIVE', CoalescingProvider(HedgedProvider(providers)))
+
+
+
+# Run `python3 bar_provider.py` to check the providers against a made-up bar store
+if __name__ == '__main__':
+    import shutil
+    import sys
+    import tempfile
+
+    root = tempfile.mkdtemp()
+    store = BarStore(root)
+    n = 100
+    t0 = 1_700_000_000 - 1_700_000_000 % INTERVAL_SECONDS
+    times = t0 + INTERVAL_SECONDS * np.arange(n)
+    close = 10 + np.cumsum(np.random.default_rng(0).normal(0, 0.01, n))
+    store.append('AAA', times, np.column_stack([close, close + 0.01, close - 0.01, close, np.full(n, 100.0)]))
+
+    # Replaying the store as of bar 59, nothing after it is visible
+    now = [int(times[59])]
+    local = LocalProvider(store, clock=lambda: now[0])
+    start = datetime.datetime.fromtimestamp(t0, datetime.timezone.utc)
+    end = datetime.datetime.fromtimestamp(t0 + n * INTERVAL_SECONDS, datetime.timezone.utc)
+    fetched_times, fetched_bars = local.fetch('AAA', start, end)
+    recent_times, _ = local.recent('AAA', 10)
+    ok = len(fetched_times) == 60 and np.array_equal(fetched_bars[:, 3], close[:60]) and np.array_equal(recent_times, times[50:60])
+    print("local provider replays up to its clock:", ok)
+
+    # A provider that fails is hedged by the next one, and when every one fails it is a ProviderError
+    class FailingProvider(BarProvider):
+        name = 'FAILING'
+
+        def fetch(self, stock_ticker, start, end):
+            raise ConnectionError("down")
+
+    hedged = HedgedProvider([FailingProvider(), local], timeout=1.0, hedge_after=0.1)
+    hedged_ok = np.array_equal(hedged.fetch('AAA', start, end)[0], fetched_times)
+    try:
+        HedgedProvider([FailingProvider()], timeout=1.0).recent('AAA', 10)
+        hedged_ok = False
+    except ProviderError as e:
+        print("all providers failing:", e)
+    print("hedged provider falls back and fails as ProviderError:", hedged_ok)
+
+    try:
+        BarProvider()
+        abstract = False
+    except TypeError:
+        abstract = True
+    print("BarProvider is abstract:", abstract)
+    shutil.rmtree(root)
+    if not (ok and hedged_ok and abstract):
+        sys.exit(1)
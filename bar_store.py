@@ -0,0 +1,84 @@
+import os
+import numpy as np
+
+from config_20XX import *
+
+
+
+# Append-only columnar bar cache, one directory per (ticker, interval).
+# Each directory holds two flat binary columns that are memory-mapped on read:
+#   times.i8 - bar open times (int64 epoch seconds, strictly increasing)
+#   bars.f8  - OHLCV rows (float64, len(BAR_COLUMNS) wide)
+class BarStore:
+
+    def __init__(self, root=BAR_STORE_DIR):
+        self.root = root
+        self.width = len(BAR_COLUMNS)
+
+    def path(self, ticker, interval=INTERVAL):
+        return os.path.join(self.root, ticker.upper(), interval)
+
+    def _files(self, ticker, interval):
+        d = self.path(ticker, interval)
+        return os.path.join(d, 'times.i8'), os.path.join(d, 'bars.f8')
+
+    def tickers(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.listdir(self.root))
+
+    def size(self, ticker, interval=INTERVAL):
+        times_file, bars_file = self._files(ticker, interval)
+        if not os.path.exists(times_file) or not os.path.exists(bars_file):
+            return 0
+        # A crash between the two appends leaves one column longer; ignore the tail
+        n_times = os.path.getsize(times_file) // 8
+        n_bars = os.path.getsize(bars_file) // (8 * self.width)
+        return min(n_times, n_bars)
+
+    # (times, bars) in [start, end) as read-only memory-mapped views
+    def read(self, ticker, interval=INTERVAL, start=None, end=None):
+        n = self.size(ticker, interval)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.width), dtype=np.float64)
+
+        times_file, bars_file = self._files(ticker, interval)
+        times = np.memmap(times_file, dtype=np.int64, mode='r', shape=(n,))
+        bars = np.memmap(bars_file, dtype=np.float64, mode='r', shape=(n, self.width))
+
+        lo = 0 if start is None else np.searchsorted(times, _epoch(start), side='left')
+        hi = n if end is None else np.searchsorted(times, _epoch(end), side='left')
+        return times[lo:hi], bars[lo:hi]
+
+    def last_time(self, ticker, interval=INTERVAL):
+        times, _ = self.read(ticker, interval)
+        return int(times[-1]) if len(times) else None
+
+    # Append the bars newer than the last stored one, returns the number of rows written
+    def append(self, ticker, times, bars, interval=INTERVAL):
+        times = np.asarray(times, dtype=np.int64)
+        bars = np.ascontiguousarray(bars, dtype=np.float64).reshape(len(times), self.width)
+
+        last = self.last_time(ticker, interval)
+        if last is not None:
+            keep = times > last
+            times, bars = times[keep], bars[keep]
+        if len(times) == 0:
+            return 0
+        assert np.all(np.diff(times) > 0), "bars must be sorted and unique"
+
+        os.makedirs(self.path(ticker, interval), exist_ok=True)
+        times_file, bars_file = self._files(ticker, interval)
+        n = self.size(ticker, interval)
+        # Bars first, then times: a row only counts once both columns hold it
+        for f, col, row_bytes in [(bars_file, bars, 8 * self.width), (times_file, times, 8)]:
+            with open(f, 'ab') as fh:
+                fh.truncate(n * row_bytes)
+                fh.write(col.tobytes())
+        return len(times)
+
+
+def _epoch(t):
+    if isinstance(t, (int, np.integer)):
+        return int(t)
+    return int(t.timestamp())
@@ -1,39 +1,104 @@
+import os
 import numpy as np
 
 # Trader params
-STOCK_TICKER = 'AMC'
+STOCK_TICKER = 'AMC' # One ticker, or several separated by commas
 INIT_CASH = 1000.0
+PORTFOLIO_CASH = 'SPLIT' # SPLIT (INIT_CASH divided per ticker) / SHARED
 
+ENGINE = 'POLL' # POLL / ASYNC
 AFTER_HOURS_SLEEP = 60
 TRADING_HOURS_SLEEP = 2
 PREDICTION_INTERVAL = 60
+ASYNC_MIN_TICK_INTERVAL = 0.25 # Stream events for one symbol within this window are coalesced
+ORDER_WAIT_TIMEOUT = 10 # Seconds to wait for cancels to be confirmed before asking the REST API
+QUOTE_MAX_AGE = 30 # Seconds after which the last trade/quote is too old to act on, None to never reject
+
+ALPACA_RATE_LIMIT = 200 # REST requests per minute allowed per account
+ALPACA_BURST = 10
+ALPACA_POOL_SIZE = 8 # Keep-alive connections, also the number of concurrent submits/cancels
+ALPACA_TIMEOUT = 10
+ALPACA_RETRIES = 3 # Retries of reads and cancels on 429/5xx, each takes a token from the rate limit
 
 CONSERVATIVE_CONST = 0.75
 
+METRICS_FILE = 'logs/metrics.prom' # Latency histograms in Prometheus text format, None to disable
+METRICS_EXPORT_INTERVAL = 10
+METRICS_PORT = None # Also serve them on http://127.0.0.1:<port>/metrics
+
+LOG_DIR = 'logs'
+LOG_QUEUE_SIZE = 10000 # Records queued before any but orders are dropped, debug ones go at 80% of it
+
+JOURNAL_DIR = 'data/journal'
+JOURNAL_SNAPSHOT_EVERY = 1000 # Journal events between snapshots
+
 MODEL_TYPE = 'TF' # TF / TORCH
 
 MODE = 'SANDBOX' # PRODUCTION / SANDBOX
 
 
+# Backtest params
+BACKTEST_SPREAD = 0.01 # Simulated bid/ask spread in $
+BACKTEST_CONSERVATIVE_CONSTS = [0.5, 0.75, 1.0]
+BACKTEST_PREDICTION_INTERVALS = [60, 120, 300]
+PREDICT_BATCH_SIZE = 4096
+QUANTIZE_INFERENCE = False # Live/backtest predictions from a dynamic int8 model, check the drift with `python3 inference.py MODEL_PATH --quantize`
+
+
 # Data params
-NUM_FEATURES = 4 
+FEATURES = ['Open', 'High', 'Low', 'Close'] # Model inputs, see features.py (e.g. 'EMA_20', 'VWAP_30', 'RSI_14', 'VOLATILITY_20')
+NUM_FEATURES = len(FEATURES)
+DTYPE = np.float32 # Windows, labels and normalization stats from windowing on, np.float64 for full precision
 NUM_WEEKS = 3
 UNITS = 'm'
 INTERVAL_UNITS = 1
 INTERVAL = str(INTERVAL_UNITS) + UNITS
+INTERVAL_SECONDS = INTERVAL_UNITS * {'m': 60, 'h': 3600, 'd': 86400}[UNITS]
 POINTS_PER_PERIOD = 15
-LABEL_FUNC = lambda x: np.mean(x[0])
+BATCH_LABEL_FUNC = lambda x: np.mean(x[:, 0], axis=-1) # Label value of each window in a stack, the mean of its first bar
+LABEL_HORIZONS = [1] # Windows ahead to label, the model predicts one value per horizon and trades on the first
+WINDOWS_PER_YEAR = max(252 * 390 * 60 // (POINTS_PER_PERIOD * INTERVAL_SECONDS), 1) # For annualizing per-window metrics
+
+BAR_STORE_DIR = 'data/bars'
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+BAR_BUFFER_SIZE = 390 # One trading session of 1m bars
+
+BAR_PROVIDER = 'YFINANCE' # YFINANCE / ALPACA / LOCAL (bar store only, for running offline) / REPLAY (recorded responses)
+BAR_FALLBACK_PROVIDER = 'ALPACA' # Hedged against BAR_PROVIDER on the live path, None to disable
+BAR_TIMEOUT = 5 # Seconds the live path waits for bars
+BAR_HEDGE_AFTER = 1.0 # Seconds before the fallback provider is asked as well
+BAR_RECORD_DIR = 'data/recorded' # Provider responses saved by RecordingProvider, replayed by ReplayProvider
+
+# Bulk history download params
+BULK_WORKERS = 8 # Chunk requests in flight at once
+BULK_CHUNK_DAYS = 7 # Days per request, the most yfinance serves at 1m
+BULK_RETRIES = 3
+BULK_BACKOFF = 0.5 # Seconds before the first retry, doubled on every retry after it
+
+# Out-of-core training params, see window_dataset.py
+TRAIN_OUT_OF_CORE = False # Train from windows memory-mapped on disk instead of arrays in RAM
+DATASET_DIR = 'data/datasets'
+DATASET_CHUNK_WINDOWS = 10000 # Windows built and written at a time
+DATASET_BLOCK_WINDOWS = 4096 # Consecutive windows read together
+DATASET_SHUFFLE_BLOCKS = 16 # Blocks shuffled together, bounds the windows in memory while training
 
 
 # Model training params
 if MODEL_TYPE == 'TF':
 	MAX_EPOCHS = 100
+	BATCH_SIZE = 32
 	PATIENCE = 2
 	TRAINING_SET_THRESH = 0.85
+	SHUFFLE_BUFFER = 100000 # Windows shuffled together, covers the whole training set for a few weeks of bars
+	JIT_COMPILE = True # XLA compile the training step
+	TF_INTRA_OP_THREADS = 0 # Threads per op, 0 lets TF pick
+	TF_INTER_OP_THREADS = 0 # Ops run concurrently, 0 lets TF pick
 
 	C_DIFF_SIGN = 0.5
 	C_SAME_SIGN = 0.1
 
+	FARM_GRID = {'C_DIFF_SIGN': [0.25, 0.5, 1.0], 'C_SAME_SIGN': [0.05, 0.1, 0.2]}
+
 elif MODEL_TYPE == 'TORCH':
 	EPOCHS = 100
 	BATCH_SIZE = 32
@@ -41,6 +106,31 @@ elif MODEL_TYPE == 'TORCH':
 	LEARNING_RATE = 1e-4
 	MOMENTUM = 0.975
 	PRINT_EVERY = 100
+	PATIENCE = 2
+	PREFETCH_BATCHES = 2
+	PIN_MEMORY = True # Only applies when training on a GPU
+	TORCH_COMPILE = False
 
 	C_DIFF_SIGN = 0.5
-	C_SAME_SIGN = 0.1
\ No newline at end of file
+	C_SAME_SIGN = 0.1
+
+	FARM_GRID = {'LEARNING_RATE': [1e-4, 1e-3], 'BATCH_SIZE': [32, 128], 'C_DIFF_SIGN': [0.5], 'C_SAME_SIGN': [0.1]}
+
+
+# Model registry params
+MODEL_REGISTRY_DIR = 'models'
+DRIFT_MIN_SAMPLES = 100 # New windows needed before drift is tested
+DRIFT_Z = 3.0 # Retrain when the recent label mean is this many standard errors away
+DRIFT_STD_RATIO = 1.5 # ...or the recent label stdev changed by more than this factor
+
+
+# Training farm params
+FARM_THREADS_PER_WORKER = 1
+FARM_WORKERS = max((os.cpu_count() or 1) // FARM_THREADS_PER_WORKER, 1)
+FARM_RESULTS_DIR = 'results'
+
+
+# Walk-forward evaluation params
+WALK_FORWARD_FOLDS = 5
+WALK_FORWARD_TRAIN_FRACTION = 0.5 # Of all windows, the size of each fold's training set
+WALK_FORWARD_EXPANDING = False # Train each fold on everything before its test block instead
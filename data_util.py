@@ -1,9 +1,14 @@
 import datetime
-import yfinance as yf
+import random
+import time
 import numpy as np
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 from config_20XX import *
+from window_util import *
+from bar_store import BarStore
+from bar_provider import history_provider, live_provider
+from features import compute_features, FEATURE_WARMUP
 
 import warnings
 warnings.filterwarnings('ignore')
@@ -14,60 +19,122 @@ np.random.seed(150)
 
 # Data cleaning
 def clean_data(stock_raw):
-    r = len(stock_raw) % POINTS_PER_PERIOD
-    for _ in range(r):
-        stock_raw = np.delete(stock_raw, 0, 0)
-    dat_shape = (len(stock_raw) // POINTS_PER_PERIOD, POINTS_PER_PERIOD, stock_raw.shape[1])
-
-    stock_dat = np.ndarray(shape=dat_shape, dtype=np.float64)
-    stock_labels = np.zeros(shape=(dat_shape[0], 1))
-    for i in range(len(stock_raw)):
-        r, t = i // POINTS_PER_PERIOD, i % POINTS_PER_PERIOD
-        stock_dat[r][t] = stock_raw[i]
-    for i in range(dat_shape[0] - 1):
-        stock_labels[i] = LABEL_FUNC(stock_dat[i + 1])
-        
-    if dat_shape[0] > 1:
-        stock_dat = stock_dat[:-1]
-        stock_labels = stock_labels[:-1]
+    stock_dat = window_data(stock_raw)
+    stock_labels = window_labels(stock_dat)
+
+    # The last windows have no future to label
+    horizon = max(LABEL_HORIZONS)
+    if len(stock_dat) > horizon:
+        stock_dat = stock_dat[:-horizon]
+        stock_labels = stock_labels[:-horizon]
     return stock_dat, stock_labels
 
 
 # Normalize the data
 def normalize_data(stock_dat, stock_labels):
-    for r in range(len(stock_dat)):
-        curr = stock_dat[r]
-        o = curr[0][0]
-        open_stdev = np.sqrt( np.sum(np.vectorize(lambda x: (x-o)**2)(curr))/(curr.size) )
-        stock_labels[r][0] = (stock_labels[r][0] - o) / open_stdev
-        stock_dat[r] = (curr - o) / open_stdev
-    return stock_dat
+    return normalize_windows(stock_dat, stock_labels)
 
 
 # Unnormalize the data (for prediction purposes)
 def unnormalize_data(stock_raw, stock_dat, stock_labels):
-    for r in range(len(stock_raw)):
-        curr = stock_raw[r]
-        o = curr[0][0]
-        open_stdev = np.sqrt( np.sum(np.vectorize(lambda x: (x-o)**2)(curr))/(curr.size) )
-        stock_labels[r][0] = stock_labels[r][0] * open_stdev + o
-        stock_dat[r] = stock_dat[r] * open_stdev + o
-    return stock_dat, stock_labels
-
-
-# Pull the data in
-def model_stock_data(stock_ticker):
-    stock = yf.Ticker(stock_ticker)
-    stock_raw = np.ndarray(shape=(0, NUM_FEATURES))
-
-    wk_end = datetime.datetime.now()
-    wk_start = wk_end - datetime.timedelta(days=7)
-    for _ in range(NUM_WEEKS):
-        stock_df = stock.history(period='7d', interval=INTERVAL, start=wk_start, end=wk_end)
-        stock_raw_week = stock_df.to_numpy()[:,:NUM_FEATURES]
-        stock_raw = np.concatenate([stock_raw_week, stock_raw])
-        
-        wk_end, wk_start = wk_start, wk_start - datetime.timedelta(days=7)
+    return unnormalize_windows(stock_raw, stock_dat, stock_labels)
+
+
+# Pull bars in [start, end) from the history provider (BAR_PROVIDER)
+def fetch_bars(stock_ticker, start, end, provider=None):
+    provider = provider if provider else history_provider()
+    return provider.fetch(stock_ticker, start, end)
+
+
+# Retry a fetch with exponential backoff and jitter, re-raising the last error
+def fetch_with_retry(provider, stock_ticker, start, end, retries=BULK_RETRIES, backoff=BULK_BACKOFF):
+    for attempt in range(retries + 1):
+        try:
+            return provider.fetch(stock_ticker, start, end)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+
+# Bars for many tickers at once. ranges is a list of (ticker, start, end), each one cut
+# into chunk_days requests that all run on a bounded thread pool. Returns the INTERVAL
+# grid times that any ticker has a bar at and a (len(ranges), len(times), len(BAR_COLUMNS))
+# array of the bars at those times, NaN where a ticker has none. Only times some ticker
+# traded at are allocated, never the nights and weekends in between.
+def bulk_fetch_bars(ranges, provider=None, workers=BULK_WORKERS, chunk_days=BULK_CHUNK_DAYS):
+    provider = provider if provider else history_provider()
+    t0 = int(min(start for _, start, _ in ranges).timestamp()) // INTERVAL_SECONDS * INTERVAL_SECONDS
+    t1 = int(max(end for _, _, end in ranges).timestamp())
+
+    chunks = []
+    for k, (stock_ticker, start, end) in enumerate(ranges):
+        while start < end:
+            chunk_end = min(start + datetime.timedelta(days=chunk_days), end)
+            chunks.append((k, stock_ticker, start, chunk_end))
+            start = chunk_end
+
+    # Bars snapped to the grid, kept per chunk until every chunk is in
+    def load(k, stock_ticker, start, end):
+        chunk_times, chunk_bars = fetch_with_retry(provider, stock_ticker, start, end)
+        chunk_times = t0 + (np.asarray(chunk_times, dtype=np.int64) - t0) // INTERVAL_SECONDS * INTERVAL_SECONDS
+        keep = (chunk_times >= t0) & (chunk_times < t1)
+        return k, chunk_times[keep], np.asarray(chunk_bars)[keep]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        loaded = [future.result() for future in [executor.submit(load, *chunk) for chunk in chunks]]
+
+    times = np.unique(np.concatenate([t for _, t, _ in loaded])) if loaded else np.zeros(0, dtype=np.int64)
+    bars = np.full((len(ranges), len(times), len(BAR_COLUMNS)), np.nan)
+    for k, chunk_times, chunk_bars in loaded:
+        bars[k, np.searchsorted(times, chunk_times)] = chunk_bars
+    return times, bars
+
+
+# Where a ticker's bar store update starts: after the last stored bar, or NUM_WEEKS back
+def _update_start(store, stock_ticker, now):
+    last = store.last_time(stock_ticker)
+    if last is None:
+        return now - datetime.timedelta(days=7 * NUM_WEEKS)
+    return datetime.datetime.fromtimestamp(last + INTERVAL_SECONDS, datetime.timezone.utc)
+
+
+# Bring the local bar store up to date, only pulling the gap since the last stored bar
+def update_bar_store(stock_ticker, store=None):
+    store = store if store else BarStore()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    start = _update_start(store, stock_ticker, now)
+
+    if start < now:
+        times, bars = fetch_bars(stock_ticker, start, now)
+        # Leave the bar that is still forming for the next update
+        complete = times + INTERVAL_SECONDS <= now.timestamp()
+        store.append(stock_ticker, times[complete], bars[complete])
+
+    return store.read(stock_ticker)
+
+
+# update_bar_store for many tickers, with every gap downloaded concurrently
+def update_bar_stores(stock_tickers, store=None, provider=None):
+    store = store if store else BarStore()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ranges = [(t, _update_start(store, t, now), now) for t in stock_tickers]
+    ranges = [r for r in ranges if r[1] < now]
+    if not ranges:
+        return
+
+    times, bars = bulk_fetch_bars(ranges, provider)
+    # Leave the bar that is still forming for the next update
+    complete = times + INTERVAL_SECONDS <= now.timestamp()
+    for (stock_ticker, _, _), ticker_bars in zip(ranges, bars):
+        keep = complete & ~np.isnan(ticker_bars[:, 0])
+        store.append(stock_ticker, times[keep], ticker_bars[keep])
+
+
+# Pull the data in, update=False uses the bar store as it is (e.g. after update_bar_stores)
+def model_stock_data(stock_ticker, update=True):
+    _, stock_bars = update_bar_store(stock_ticker) if update else BarStore().read(stock_ticker)
+    stock_raw = compute_features(stock_bars)
 
     # Format data
     stock_raw, stock_labels = clean_data(stock_raw)
@@ -76,14 +143,11 @@ def model_stock_data(stock_ticker):
     return stock_raw, stock_dat, stock_labels
 
 
-# Get last interval of data
+# Get last interval of data, raises ProviderError if no provider answers in BAR_TIMEOUT
 def recent_stock_data(stock_ticker):
-    stock = yf.Ticker(stock_ticker)
-    stock_raw = np.ndarray(shape=(0, NUM_FEATURES))
-
-    period = str(2 * (POINTS_PER_PERIOD * INTERVAL_UNITS) - 1) + UNITS
-    stock_df = stock.history(period=period, interval=INTERVAL)
-    stock_raw = stock_df.to_numpy()[:,:NUM_FEATURES]
+    # Extra bars in front to warm up the features, dropped once they are computed
+    _, stock_bars = live_provider().recent(stock_ticker, 2 * POINTS_PER_PERIOD - 1 + FEATURE_WARMUP)
+    stock_raw = compute_features(stock_bars)[FEATURE_WARMUP:]
 
     # Format data
     stock_raw, _ = clean_data(stock_raw)
@@ -101,3 +165,51 @@ def partition_data(thresh, stock_dat, stock_labels):
     validation_y = stock_labels[split:]
 
     return training_x, training_y, validation_x, validation_y
+
+
+
+# Run `python3 data_util.py [TICKERS]` to bulk load a made-up universe from a slow, flaky
+# provider, record it, and check that a replay of the recording gives the same array
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    from bar_provider import BarProvider, RecordingProvider, ReplayProvider
+
+    class FakeProvider(BarProvider):
+        name = 'FAKE'
+
+        def __init__(self, latency=0.05, failure_rate=0.1):
+            self.latency = latency
+            self.failure_rate = failure_rate
+            self.calls = 0
+
+        # Minute bars for the 6.5 trading hours of every weekday, 20 minutes of each missing
+        def fetch(self, stock_ticker, start, end):
+            self.calls += 1
+            time.sleep(self.latency)
+            if random.random() < self.failure_rate:
+                raise ConnectionError("flaky")
+            t = np.arange(int(start.timestamp()) // 60 * 60, int(end.timestamp()), 60)
+            minute = (t % 86400) // 60
+            t = t[(minute >= 870) & (minute < 1260) & ((t // 86400 + 3) % 7 < 5) & (minute % 20 != sum(map(ord, stock_ticker)) % 20)]
+            close = 10 + np.sin(t / 1e4 + len(stock_ticker))
+            return t, np.column_stack([close, close + 0.1, close - 0.1, close, t % 1000])
+
+    tickers = ['T%03d' % i for i in range(int(sys.argv[1]) if len(sys.argv) > 1 else 50)]
+    end = datetime.datetime(2024, 3, 1, tzinfo=datetime.timezone.utc)
+    ranges = [(t, end - datetime.timedelta(days=7 * NUM_WEEKS), end) for t in tickers]
+    root = tempfile.mkdtemp()
+
+    fake = FakeProvider()
+    start = time.perf_counter()
+    times, bars = bulk_fetch_bars(ranges, RecordingProvider(fake, root), chunk_days=BULK_CHUNK_DAYS)
+    seconds = time.perf_counter() - start
+    print("%d tickers, %d requests (with retries) in %.2fs on %d workers, %.2fs serially" % (len(tickers), fake.calls,
+        seconds, BULK_WORKERS, fake.calls * fake.latency))
+    print("array", bars.shape, "%.1f%% filled" % (100 * np.mean(~np.isnan(bars[:, :, 0]))))
+
+    replay_times, replay_bars = bulk_fetch_bars(ranges, ReplayProvider(root))
+    identical = np.array_equal(times, replay_times) and np.array_equal(bars, replay_bars, equal_nan=True)
+    print("replay identical:", identical)
+    if not identical:
+        sys.exit(1)
@@ -0,0 +1,248 @@
+import abc
+import math
+import numpy as np
+
+from config_20XX import *
+
+
+
+# Model input features, declared by name in FEATURES:
+#   'Open', 'High', 'Low', 'Close', 'Volume'  raw bar columns
+#   'EMA_<n>'         exponential moving average of the close, span n
+#   'VWAP_<n>'        volume weighted (H+L+C)/3 over the last n bars
+#   'RSI_<n>'         Wilder's relative strength of the last n bars, in [0, 1]
+#   'VOLATILITY_<n>'  stdev of the last n close-to-close returns
+# Every feature is a pure step function over its own small state,
+#   value, state = feature.step(state, bar)
+# so the live path can commit a completed bar or peek at the one still forming in
+# O(1) per bar, and batch computation runs the very same arithmetic. Windowed sums are
+# running sums differenced n bars apart, so batch() can vectorize them with np.cumsum
+# and still match step() bit for bit.
+
+class Feature(abc.ABC):
+    price = True # Price-like features are normalized with the window, the rest are left as is
+    warmup = 0 # Bars of history before the value no longer depends on where it started
+
+    def init(self):
+        return None
+
+    @abc.abstractmethod
+    def step(self, state, bar):
+        pass
+
+    def batch(self, bars):
+        out = np.empty(len(bars))
+        state = self.init()
+        for i, bar in enumerate(bars.tolist()):
+            out[i], state = self.step(state, bar)
+        return out
+
+
+class Column(Feature):
+
+    def __init__(self, name):
+        self.i = BAR_COLUMNS.index(name)
+        self.price = name != 'Volume'
+
+    def step(self, state, bar):
+        return bar[self.i], state
+
+    def batch(self, bars):
+        return np.array(bars[:, self.i], dtype=np.float64)
+
+
+class EMA(Feature):
+
+    def __init__(self, n):
+        self.alpha = 2 / (n + 1)
+        self.warmup = 4 * n
+
+    def step(self, state, bar):
+        close = bar[3]
+        ema = close if state is None else state + self.alpha * (close - state)
+        return ema, ema
+
+    # The recursion can not be vectorized bit for bit, but it only needs the closes
+    def batch(self, bars):
+        out = bars[:, 3].tolist()
+        alpha = self.alpha
+        for i in range(1, len(out)):
+            out[i] = out[i - 1] + alpha * (out[i] - out[i - 1])
+        return np.array(out, dtype=np.float64)
+
+
+class VWAP(Feature):
+
+    def __init__(self, n):
+        self.n = n
+        self.warmup = n
+
+    # Running sums of price * volume and of volume, and those sums as of the last n + 1 bars
+    def init(self):
+        return 0.0, 0.0, ()
+
+    def step(self, state, bar):
+        pv_sum, v_sum, past = state
+        pv_sum += (bar[1] + bar[2] + bar[3]) / 3 * bar[4]
+        v_sum += bar[4]
+        past = (past + ((pv_sum, v_sum),))[-(self.n + 1):]
+        pv, volume = pv_sum, v_sum
+        if len(past) > self.n:
+            pv, volume = pv_sum - past[0][0], v_sum - past[0][1]
+        return (pv / volume if volume > 0 else bar[3]), (pv_sum, v_sum, past)
+
+    def batch(self, bars):
+        pv = np.cumsum((bars[:, 1] + bars[:, 2] + bars[:, 3]) / 3 * bars[:, 4])
+        volume = np.cumsum(bars[:, 4])
+        pv[self.n:] -= pv[:-self.n].copy()
+        volume[self.n:] -= volume[:-self.n].copy()
+        out = np.array(bars[:, 3], dtype=np.float64)
+        np.divide(pv, volume, out=out, where=volume > 0)
+        return out
+
+
+class RSI(Feature):
+    price = False
+
+    def __init__(self, n):
+        self.n = n
+        self.warmup = 4 * n
+
+    def step(self, state, bar):
+        close = bar[3]
+        if state is None:
+            return 0.5, (close, 0.0, 0.0)
+        prev_close, avg_gain, avg_loss = state
+        change = close - prev_close
+        avg_gain += (max(change, 0.0) - avg_gain) / self.n
+        avg_loss += (max(-change, 0.0) - avg_loss) / self.n
+        total = avg_gain + avg_loss
+        return (avg_gain / total if total > 0 else 0.5), (close, avg_gain, avg_loss)
+
+
+class Volatility(Feature):
+    price = False
+
+    def __init__(self, n):
+        self.n = n
+        self.warmup = n + 1
+
+    # Previous close, running sums of the returns and of their squares, and those sums as
+    # of the last n + 1 returns
+    def step(self, state, bar):
+        close = bar[3]
+        if state is None:
+            return 0.0, (close, 0.0, 0.0, ())
+        prev_close, r_sum, r2_sum, past = state
+        r = (close / prev_close - 1) if prev_close else 0.0
+        r_sum += r
+        r2_sum += r * r
+        past = (past + ((r_sum, r2_sum),))[-(self.n + 1):]
+        state = (close, r_sum, r2_sum, past)
+        count = min(len(past), self.n)
+        if count < 2:
+            return 0.0, state
+        total, total2 = r_sum, r2_sum
+        if len(past) > self.n:
+            total, total2 = r_sum - past[0][0], r2_sum - past[0][1]
+        mean = total / count
+        return math.sqrt(max(total2 / count - mean * mean, 0.0)), state
+
+    def batch(self, bars):
+        out = np.zeros(len(bars))
+        if len(bars) < 2:
+            return out
+        close = bars[:, 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.where(close[:-1] != 0, close[1:] / close[:-1] - 1, 0.0)
+        total, total2 = np.cumsum(r), np.cumsum(r * r)
+        total[self.n:] -= total[:-self.n].copy()
+        total2[self.n:] -= total2[:-self.n].copy()
+        count = np.minimum(np.arange(1, len(r) + 1), self.n).astype(np.float64)
+        mean = total / count
+        out[1:] = np.where(count >= 2, np.sqrt(np.maximum(total2 / count - mean * mean, 0.0)), 0.0)
+        return out
+
+
+FEATURE_TYPES = {'EMA': EMA, 'VWAP': VWAP, 'RSI': RSI, 'VOLATILITY': Volatility}
+
+
+def parse_feature(name):
+    if name in BAR_COLUMNS:
+        return Column(name)
+    kind, _, n = name.upper().partition('_')
+    if kind not in FEATURE_TYPES or not n.isdigit():
+        raise ValueError("Unknown feature %r" % name)
+    return FEATURE_TYPES[kind](int(n))
+
+
+def parse_features(names=FEATURES):
+    # Prices are unnormalized against the first open of each window
+    if names[0] != 'Open':
+        raise ValueError("The first feature must be 'Open'")
+    return [parse_feature(name) for name in names]
+
+
+PRICE_MASK = np.array([f.price for f in parse_features()])
+# Labels are taken from the raw prices only
+LABEL_MASK = np.array([isinstance(f, Column) and f.price for f in parse_features()])
+FEATURE_WARMUP = max(f.warmup for f in parse_features())
+
+
+# (N, len(FEATURES)) features for N bars in one pass over the history
+def compute_features(bars, names=FEATURES):
+    bars = np.asarray(bars, dtype=np.float64)
+    return np.column_stack([f.batch(bars) for f in parse_features(names)]).reshape(len(bars), len(names))
+
+
+# Incremental version of compute_features for streamed bars
+class FeatureEngine:
+
+    def __init__(self, names=FEATURES):
+        self.features = parse_features(names)
+        self.states = [f.init() for f in self.features]
+
+    # Features of a completed bar, advancing the state past it
+    def update(self, bar):
+        bar = bar.tolist() if isinstance(bar, np.ndarray) else bar
+        row = np.empty(len(self.features))
+        for k, feature in enumerate(self.features):
+            row[k], self.states[k] = feature.step(self.states[k], bar)
+        return row
+
+    # Features of the bar still forming, without advancing the state
+    def peek(self, bar, out=None):
+        bar = bar.tolist() if isinstance(bar, np.ndarray) else bar
+        row = out if out is not None else np.empty(len(self.features))
+        for k, feature in enumerate(self.features):
+            row[k], _ = feature.step(self.states[k], bar)
+        return row
+
+
+
+# Run `python3 features.py [N]` to check the incremental engine against the batch features
+if __name__ == '__main__':
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    names = ['Open', 'High', 'Low', 'Close', 'Volume', 'EMA_12', 'EMA_26', 'VWAP_30', 'RSI_14', 'VOLATILITY_20']
+    rng = np.random.default_rng(0)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 1e-3, n)))
+    bars = np.column_stack([close, close * 1.001, close * 0.999, close, rng.integers(0, 1000, n).astype(np.float64)])
+
+    start = time.perf_counter()
+    batch = compute_features(bars, names)
+    batch_seconds = time.perf_counter() - start
+
+    engine = FeatureEngine(names)
+    start = time.perf_counter()
+    peeked = np.array([engine.peek(bar) for bar in bars[:1]])
+    incremental = np.array([engine.update(bar) for bar in bars])
+    update_us = (time.perf_counter() - start) / n * 1e6
+
+    identical = np.array_equal(batch, incremental, equal_nan=True) and np.array_equal(peeked, batch[:1])
+    print("%d bars x %d features: batch %.3fs, incremental %.1fus per bar" % (n, len(names), batch_seconds, update_us))
+    print("batch and incremental identical:", identical)
+    if not identical:
+        sys.exit(1)
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+
+
+# Import `modules` in a fresh interpreter with -X importtime and return
+# [(top-level module, cumulative seconds)], slowest first
+def profile_imports(modules):
+	code = "; ".join("import %s" % m for m in modules)
+	proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+
+	times = {}
+	for line in proc.stderr.splitlines():
+		if not line.startswith('import time:') or 'cumulative' in line:
+			continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		# Nested imports are indented, only count modules imported at the top level
+		if name.startswith('  '):
+			continue
+		top = name.strip().split('.')[0]
+		times[top] = times.get(top, 0) + int(cumulative) / 1e6
+
+	if proc.returncode != 0:
+		print(proc.stderr.strip().splitlines()[-1])
+	return sorted(times.items(), key=lambda t: t[1], reverse=True)
+
+
+def print_import_profile(modules, top=20):
+	results = profile_imports(modules)
+	print("%-30s %10s" % ("MODULE", "SECONDS"))
+	for name, seconds in results[:top]:
+		print("%-30s %10.3f" % (name, seconds))
+	print("%-30s %10.3f" % ("TOTAL", sum(s for _, s in results)))
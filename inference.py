@@ -0,0 +1,190 @@
+import copy
+import sys
+import time
+import numpy as np
+
+from config_20XX import *
+
+
+
+# Single-window predictors for the live path. Both export the trained model once to a
+# lean callable with a fixed (1, POINTS_PER_PERIOD, NUM_FEATURES) float32 input and copy
+# each window into a preallocated buffer, skipping the per-call batching machinery of
+# model.predict. Other shapes fall back to the plain model.
+# With quantize the LSTM and Dense weights are dynamically quantized to int8 (activations
+# are quantized on the fly), see quantization_report for what that costs in accuracy.
+
+class TFPredictor:
+
+	def __init__(self, model, quantize=False):
+		import tensorflow as tf
+		self.model = model
+		self.quantize = quantize
+		self.buffer = np.zeros((1, POINTS_PER_PERIOD, NUM_FEATURES), dtype=np.float32)
+		spec = tf.TensorSpec(self.buffer.shape, tf.float32)
+		if quantize:
+			self.fn = self.tflite_fn(tf, model, spec)
+			self.fn(self.buffer)
+			return
+		try:
+			self.fn = tf.function(lambda x: model(x, training=False), input_signature=[spec], jit_compile=True)
+			self.fn(self.buffer)
+		except Exception as e:
+			print("XLA compile failed (%s), using a plain tf.function" % e)
+			self.fn = tf.function(lambda x: model(x, training=False), input_signature=[spec])
+			self.fn(self.buffer)
+
+	# TFLite dynamic range quantization of the model at the fixed single-window shape
+	def tflite_fn(self, tf, model, spec):
+		concrete = tf.function(lambda x: model(x, training=False), input_signature=[spec]).get_concrete_function()
+		converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete], model)
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+		interpreter = tf.lite.Interpreter(model_content=converter.convert())
+		interpreter.allocate_tensors()
+		input_index = interpreter.get_input_details()[0]['index']
+		output_index = interpreter.get_output_details()[0]['index']
+
+		def fn(x):
+			interpreter.set_tensor(input_index, x)
+			interpreter.invoke()
+			return interpreter.get_tensor(output_index)
+		return fn
+
+	def predict(self, stock_dat, **kwargs):
+		if np.shape(stock_dat) != self.buffer.shape:
+			if self.quantize:
+				return np.concatenate([self.predict(window[None]) for window in stock_dat])
+			return self.model.predict(stock_dat, verbose=0, **kwargs)
+		self.buffer[...] = stock_dat
+		return np.asarray(self.fn(self.buffer))
+
+
+class TorchPredictor:
+
+	def __init__(self, model, quantize=False):
+		import torch as th
+		self.th = th
+		# Work on a CPU copy, the caller's model keeps its device and training mode
+		self.model = copy.deepcopy(model).to('cpu').eval()
+		if quantize:
+			# A quantized copy, the float model stays as it is for retraining
+			self.model = th.ao.quantization.quantize_dynamic(self.model, {th.nn.LSTM, th.nn.Linear}, dtype=th.qint8)
+		self.buffer = th.zeros((1, POINTS_PER_PERIOD, NUM_FEATURES), dtype=th.float32)
+		self.buffer_np = self.buffer.numpy()
+		with th.inference_mode():
+			try:
+				module = th.jit.freeze(th.jit.trace(self.model, self.buffer))
+				self.module = th.jit.optimize_for_inference(module)
+			except Exception as e:
+				print("TorchScript export failed (%s), using the eager model" % e)
+				self.module = self.model
+			self.module(self.buffer)
+
+	def predict(self, stock_dat, batch_size=PREDICT_BATCH_SIZE, **kwargs):
+		th = self.th
+		with th.inference_mode():
+			if np.shape(stock_dat) == self.buffer.shape:
+				self.buffer_np[...] = stock_dat
+				return self.module(self.buffer).numpy()
+			x = th.from_numpy(np.ascontiguousarray(stock_dat, dtype=np.float32))
+			return th.cat([self.model(x[i:i + batch_size]) for i in range(0, len(x), batch_size)]).numpy()
+
+
+# Wrap a trained backend model, anything else (e.g. a stub) is used as is
+def make_predictor(model, quantize=QUANTIZE_INFERENCE):
+	module = type(model).__module__
+	if module.startswith(('keras', 'tensorflow')):
+		return TFPredictor(model, quantize)
+	if module.startswith('torch'):
+		return TorchPredictor(model, quantize)
+	return model
+
+
+def latency_percentiles(fn, n):
+	latencies = np.zeros(n)
+	for i in range(n):
+		start = time.perf_counter()
+		fn()
+		latencies[i] = time.perf_counter() - start
+	return np.percentile(latencies, [50, 99]) * 1000
+
+
+# Predictions of the int8 predictor against the float one over the same (normalized)
+# windows: how far they move, how often the traded direction flips, and the latency of each
+def quantization_report(model, stock_dat, n=1000):
+	stock_dat = np.asarray(stock_dat, dtype=np.float32)
+	float_predictor = make_predictor(model, quantize=False)
+	int8_predictor = make_predictor(model, quantize=True)
+	expected = float_predictor.predict(stock_dat)
+	actual = int8_predictor.predict(stock_dat)
+	error = np.abs(actual - expected)
+
+	window = stock_dat[:1]
+	report = {
+		'windows': len(stock_dat),
+		'max_abs_error': float(np.max(error)),
+		'mean_abs_error': float(np.mean(error)),
+		'relative_error': float(np.mean(error) / max(np.mean(np.abs(expected)), 1e-12)),
+		'direction_flips': float(np.mean((expected[:, 0] > 0) != (actual[:, 0] > 0))),
+		'float_ms': latency_percentiles(lambda: float_predictor.predict(window), n),
+		'int8_ms': latency_percentiles(lambda: int8_predictor.predict(window), n),
+	}
+	print("Int8 drift over %d windows:" % report['windows'])
+	print("  max abs error   %.6f" % report['max_abs_error'])
+	print("  mean abs error  %.6f (%.2f%% of the mean |prediction|)" % (report['mean_abs_error'], 100 * report['relative_error']))
+	print("  direction flips %.2f%%" % (100 * report['direction_flips']))
+	print("%-10s %10s %10s" % ("", "p50 (ms)", "p99 (ms)"))
+	for name in ['float', 'int8']:
+		print("%-10s %10.3f %10.3f" % ((name,) + tuple(report[name + '_ms'])))
+	return report
+
+
+# Compare per-window latency of the plain model against its predictor
+def benchmark(model, n=1000):
+	stock_dat = np.random.randn(1, POINTS_PER_PERIOD, NUM_FEATURES)
+	predictor = make_predictor(model)
+	if hasattr(model, 'predict'):
+		baseline = lambda: model.predict(stock_dat, verbose=0)
+	else:
+		import torch as th
+		baseline = lambda: model(th.from_numpy(stock_dat).float()).detach().numpy()
+
+	for _ in range(10):
+		baseline()
+		predictor.predict(stock_dat)
+	results = {
+		'model': latency_percentiles(baseline, n),
+		'predictor': latency_percentiles(lambda: predictor.predict(stock_dat), n),
+	}
+	print("%-10s %10s %10s" % ("", "p50 (ms)", "p99 (ms)"))
+	for name, (p50, p99) in results.items():
+		print("%-10s %10.3f %10.3f" % (name, p50, p99))
+	return results
+
+
+
+# Run `python3 inference.py MODEL_PATH [N]` to benchmark single-window prediction latency,
+# or `python3 inference.py MODEL_PATH [N] --quantize [TICKER]` for the int8 drift report
+# over the stored bars of TICKER (random windows without one)
+if __name__ == '__main__':
+	args = [a for a in sys.argv[1:] if not a.startswith('--')]
+	if len(args) < 1:
+		print('ERROR: Need to specify a saved model')
+		exit(1)
+
+	from model_registry import backend
+
+	model = backend().load_model(args[0])
+	n = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1000
+	if '--quantize' not in sys.argv:
+		benchmark(model, n)
+		exit(0)
+
+	ticker = args[-1].upper() if len(args) > 1 and not args[-1].isdigit() else None
+	if ticker:
+		from data_util import model_stock_data
+		_, stock_dat, _ = model_stock_data(ticker, update=False)
+	else:
+		stock_dat = np.random.randn(5000, POINTS_PER_PERIOD, NUM_FEATURES)
+	quantization_report(model, stock_dat, n)
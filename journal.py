@@ -0,0 +1,102 @@
+import json
+import os
+import time
+
+from config_20XX import *
+
+
+
+def empty_trader_state():
+	return {'shares': 0, 'cash_flow': 0.0, 'price_target': 0.0, 'orders': {}}
+
+
+# Apply one journal event to the state of its trader. Used both while trading and
+# when replaying the journal, so the two can never disagree.
+def apply_event(state, event):
+	trader = state['traders'].setdefault(event['symbol'], empty_trader_state())
+	kind = event['event']
+	if kind == 'order':
+		trader['orders'][str(event['order']['id'])] = event['order']
+	elif kind == 'fill':
+		trader['shares'] += event['shares']
+		trader['cash_flow'] += event['cash']
+		trader['orders'].pop(str(event['order_id']), None)
+	elif kind == 'close':
+		trader['orders'].pop(str(event['order_id']), None)
+	elif kind == 'target':
+		trader['price_target'] = event['price_target']
+	state['seq'] = event['seq']
+	state['updated'] = event['ts']
+
+
+# Append-only journal of trader state transitions with periodic snapshots:
+#   <dir>/<name>.snapshot.json  full state as of some sequence number
+#   <dir>/<name>.journal        JSON lines appended since, one per event
+# Events are buffered and made durable by commit(), one fsync per trading tick at
+# most. Loading is the snapshot plus the journal tail, no broker history is needed.
+class TraderJournal:
+
+	def __init__(self, name, root=JOURNAL_DIR, snapshot_every=JOURNAL_SNAPSHOT_EVERY):
+		os.makedirs(root, exist_ok=True)
+		self.snapshot_path = os.path.join(root, name + '.snapshot.json')
+		self.journal_path = os.path.join(root, name + '.journal')
+		self.snapshot_every = snapshot_every
+
+		self.state = self.load()
+		self.since_snapshot = 0
+		self.dirty = False
+		self.file = open(self.journal_path, 'a')
+
+	def load(self):
+		state = {'seq': 0, 'updated': None, 'traders': {}}
+		if os.path.exists(self.snapshot_path):
+			with open(self.snapshot_path) as f:
+				state = json.load(f)
+		if os.path.exists(self.journal_path):
+			with open(self.journal_path) as f:
+				for line in f:
+					try:
+						event = json.loads(line)
+					except ValueError:
+						# Torn last write from a crash, everything before it is intact
+						break
+					# Events already in the snapshot survive a crash between snapshot and truncate
+					if event['seq'] > state['seq']:
+						apply_event(state, event)
+		return state
+
+	def trader_state(self, symbol):
+		return self.state['traders'].get(symbol)
+
+	def append(self, symbol, event, **fields):
+		event = dict(fields, seq=self.state['seq'] + 1, ts=time.time(), symbol=symbol, event=event)
+		apply_event(self.state, event)
+		self.file.write(json.dumps(event) + "\n")
+		self.dirty = True
+		self.since_snapshot += 1
+
+	# Make everything appended so far durable
+	def commit(self):
+		if not self.dirty:
+			return
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.dirty = False
+		if self.since_snapshot >= self.snapshot_every:
+			self.snapshot()
+
+	# Write the full state and start an empty journal
+	def snapshot(self):
+		tmp_path = self.snapshot_path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(self.state, f)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, self.snapshot_path)
+		self.file.close()
+		self.file = open(self.journal_path, 'w')
+		self.since_snapshot = 0
+
+	def close(self):
+		self.commit()
+		self.file.close()
@@ -0,0 +1,121 @@
+import contextlib
+import http.server
+import math
+import os
+import threading
+import time
+import numpy as np
+
+from config_20XX import *
+
+
+
+# Log-bucketed latency histogram in the spirit of HdrHistogram: BUCKETS_PER_OCTAVE
+# buckets per power of two from 1us up, so any percentile is within ~4% of the truth
+# and recording is O(1) with fixed memory
+class LatencyHistogram:
+	BUCKETS_PER_OCTAVE = 16
+	OCTAVES = 36 # 1us .. ~19h
+
+	def __init__(self):
+		self.counts = [0] * (self.BUCKETS_PER_OCTAVE * self.OCTAVES)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def record(self, seconds):
+		us = max(seconds * 1e6, 1.0)
+		i = min(int(math.log2(us) * self.BUCKETS_PER_OCTAVE), len(self.counts) - 1)
+		self.counts[i] += 1
+		self.count += 1
+		self.sum += seconds
+		self.max = max(self.max, seconds)
+
+	# Upper edge of the bucket holding the p-th percentile, in seconds
+	def percentile(self, p):
+		if self.count == 0:
+			return 0.0
+		i = int(np.searchsorted(np.cumsum(self.counts), math.ceil(self.count * p / 100)))
+		return min(2 ** ((i + 1) / self.BUCKETS_PER_OCTAVE) / 1e6, self.max)
+
+
+
+# Per-stage latency histograms for the trading loop, exported in Prometheus text format
+class LatencyMetrics:
+	QUANTILES = [0.5, 0.9, 0.99, 0.999]
+
+	def __init__(self, export_path=METRICS_FILE, export_interval=METRICS_EXPORT_INTERVAL):
+		self.histograms = {}
+		self.lock = threading.Lock()
+		self.export_path = export_path
+		self.export_interval = export_interval
+		self.last_export = time.monotonic()
+
+	def record(self, stage, seconds):
+		with self.lock:
+			if stage not in self.histograms:
+				self.histograms[stage] = LatencyHistogram()
+			self.histograms[stage].record(seconds)
+
+	@contextlib.contextmanager
+	def timer(self, stage):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record(stage, time.perf_counter() - start)
+
+	def prometheus(self):
+		lines = ["# HELP trader_latency_seconds Latency of each trading loop stage",
+				"# TYPE trader_latency_seconds summary"]
+		with self.lock:
+			for stage, h in sorted(self.histograms.items()):
+				for q in self.QUANTILES:
+					lines.append('trader_latency_seconds{stage="%s",quantile="%s"} %.9f' % (stage, q, h.percentile(q * 100)))
+				lines.append('trader_latency_seconds_sum{stage="%s"} %.9f' % (stage, h.sum))
+				lines.append('trader_latency_seconds_count{stage="%s"} %d' % (stage, h.count))
+		return "\n".join(lines) + "\n"
+
+	def summary(self):
+		print("%-18s %8s %10s %10s %10s %10s" % ("STAGE", "COUNT", "p50 (ms)", "p99 (ms)", "p99.9 (ms)", "MAX (ms)"))
+		with self.lock:
+			for stage, h in sorted(self.histograms.items()):
+				print("%-18s %8d %10.3f %10.3f %10.3f %10.3f" % (stage, h.count,
+					h.percentile(50) * 1000, h.percentile(99) * 1000, h.percentile(99.9) * 1000, h.max * 1000))
+
+	def export(self, path=None):
+		path = path or self.export_path
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		tmp_path = path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			f.write(self.prometheus())
+		os.replace(tmp_path, path)
+
+	# Cheap enough to call every tick, only writes every export_interval seconds
+	def maybe_export(self):
+		if self.export_path and time.monotonic() - self.last_export >= self.export_interval:
+			self.last_export = time.monotonic()
+			self.export()
+
+	# Serve /metrics on localhost for a Prometheus scraper
+	def serve(self, port=METRICS_PORT):
+		metrics = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = metrics.prometheus().encode()
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, *args):
+				pass
+
+		server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		return server
+
+
+METRICS = LatencyMetrics()
@@ -1,74 +1,159 @@
 import argparse
 import datetime
-import pytz
-import sys
+import threading
+from types import SimpleNamespace
 
 from order import *
 from trader import *
-from alpaca.client import TradingClient
+from portfolio import Portfolio
+from async_engine import AsyncTradingEngine
+from model_registry import ModelRegistry, refresh_in_background, backend
+from import_profile import print_import_profile
+from latency import METRICS
+from trade_log import LOG
+from journal import TraderJournal
+from window_dataset import build_dataset
 
 from config_20XX import *
-
-if MODEL_TYPE == 'TF':
-	from model_tf import *
-elif MODEL_TYPE == 'TORCH':
-	from model_pytorch import *
 from data_util import *
 
+# The ML backend, plotting, yfinance and the Alpaca client are imported when first used
+
 
 
-class Logger(object):
-	def __init__(self):
-		self.terminal = sys.stdout
+# Windows of every ticker's stored bars, memory-mapped on disk with TRAIN_OUT_OF_CORE:
+# their time span, windows, labels, normalization stats, the number of windows of each
+# ticker and the WindowDataset (None in memory)
+def load_training_data(stock_tickers):
+	store = BarStore()
+	empty = [t for t in stock_tickers if store.size(t) == 0]
+	if empty:
+		raise ValueError("No bars stored for %s, nothing to train on" % ", ".join(empty))
+	data_start = min(int(store.read(t)[0][0]) for t in stock_tickers)
+	data_end = max(store.last_time(t) for t in stock_tickers)
 
-	def write(self, message):
-		log_datetime = datetime.datetime.now(tz).strftime("%m-%d-%Y")
-		with open ("logs/trader_%s.log" % log_datetime, 'a') as self.log:            
-			self.log.write(message)
-		self.terminal.write(message)
+	if TRAIN_OUT_OF_CORE:
+		# Windows stay memory-mapped on disk, the splits are index ranges into them
+		dataset = build_dataset(stock_tickers, store=store)
+		return SimpleNamespace(data_start=data_start, data_end=data_end, stock_dat=dataset.x, stock_labels=dataset.y,
+			stock_stats=dataset.stats, ticker_samples=np.diff(dataset.meta['offsets']).tolist(), dataset=dataset)
 
-	def flush(self):
-		pass
+	stock_data = [model_stock_data(t, update=False) for t in stock_tickers]
+	return SimpleNamespace(data_start=data_start, data_end=data_end,
+		stock_dat=np.concatenate([d[1] for d in stock_data]), stock_labels=np.concatenate([d[2] for d in stock_data]),
+		stock_stats=np.concatenate([normalization_stats(d[0]) for d in stock_data]),
+		ticker_samples=[len(d[2]) for d in stock_data], dataset=None)
 
 
 def get_args():
 	parser = argparse.ArgumentParser(description='Trade some stonks.')
 	parser.add_argument('--t', dest='ticker',
 						type=str, required=False,
-						help='the ticker of the stock to be traded')
+						help='the ticker of the stock to be traded (comma separated for several)')
 	parser.add_argument('--m', dest='model',
 						type=str, required=False,
 						help='the path of the file in which the model has been saved')
+	parser.add_argument('--retrain', dest='retrain', action='store_true',
+						help='train a new model even if the registry has a compatible one')
+	parser.add_argument('--profile-startup', dest='profile_startup', action='store_true',
+						help='report the import time of each module on the trading path and exit')
 	return parser.parse_args()
 
 
 if __name__ == '__main__':
 	args = get_args()
 
+	if args.profile_startup:
+		backend_module = 'model_tf' if MODEL_TYPE == 'TF' else 'model_pytorch'
+		print_import_profile(['main', backend_module, 'alpaca.client', 'yfinance'])
+		exit(0)
+
 	if args.ticker:
 		STOCK_TICKER = args.ticker
-	STOCK_TICKER = STOCK_TICKER.upper()
+	STOCK_TICKERS = [t.strip().upper() for t in STOCK_TICKER.split(',')]
 
-	stock_raw, stock_dat, stock_labels = model_stock_data(STOCK_TICKER)
-	train_x, train_y, test_x, test_y = partition_data(TRAINING_SET_THRESH, stock_dat, stock_labels)
-	train_x, train_y, val_x, val_y = partition_data(TRAINING_SET_THRESH, train_x, train_y)
-	input_frame_shape = (stock_dat.shape[1], stock_dat.shape[2])
+	# A saved model is loaded straight away, the data is only updated and windowed up front
+	# when there is a model to train. One model is shared by every ticker, trained on all of their data.
+	registry = ModelRegistry()
+	artifact = None if args.retrain else registry.latest(STOCK_TICKERS)
 
 	if args.model:
-		load_model(args.model)
+		model = backend().load_model(args.model)
+	elif artifact:
+		print("Loading model trained on data up to %s from %s" % (datetime.datetime.fromtimestamp(artifact['data_end']), artifact['path']))
+		model = registry.load(artifact)
 	else:
-		model = generate_model(input_frame_shape)
-		train_model(model, train_x, train_y, val_x, val_y)
-		eval_model(STOCK_TICKER, model, test_x, test_y)
-
-	trading_client = TradingClient(STOCK_TICKER)
-	trader = Trader(STOCK_TICKER, model, trading_client, INIT_CASH)
+		update_bar_stores(STOCK_TICKERS)
+		data = load_training_data(STOCK_TICKERS)
+		if data.dataset:
+			train_range, val_range, (test_lo, test_hi) = data.dataset.splits()
+			model = backend().new_trained_model_from_dataset(data.dataset, train_range, val_range)
+		else:
+			train_x, train_y, _, _ = partition_data(TRAINING_SET_THRESH, data.stock_dat, data.stock_labels)
+			train_x, train_y, val_x, val_y = partition_data(TRAINING_SET_THRESH, train_x, train_y)
+			input_frame_shape = (data.stock_dat.shape[1], data.stock_dat.shape[2])
+			model = backend().new_trained_model(input_frame_shape, train_x, train_y, val_x, val_y)
+			test_lo, test_hi = len(train_x) + len(val_x), len(data.stock_dat)
+		metrics = backend().eval_model(",".join(STOCK_TICKERS), model, data.stock_dat[test_lo:test_hi],
+			data.stock_labels[test_lo:test_hi], data.stock_stats[test_lo:test_hi])
+		registry.save(model, STOCK_TICKERS, data.data_start, data.data_end, data.stock_labels, data.ticker_samples, metrics)
+
+	from alpaca.client import TradingClient
+	trading_client = TradingClient(STOCK_TICKERS)
+	for t in STOCK_TICKERS:
+		trading_client.seed_bars(*BarStore().read(t), symbol=t)
+	journal = TraderJournal(registry.key(STOCK_TICKERS))
+	if len(STOCK_TICKERS) == 1:
+		trader = Trader(STOCK_TICKERS[0], model, trading_client, INIT_CASH, journal=journal)
+	else:
+		trader = Portfolio(STOCK_TICKERS, model, trading_client, INIT_CASH, shared_cash=(PORTFOLIO_CASH == 'SHARED'), journal=journal)
+	traders = trader.traders if isinstance(trader, Portfolio) else [trader]
+
+	if journal.state['updated']:
+		# Pick up where the last session left off, with one bulk fetch of orders and positions
+		placed = [o['placed'] for s in journal.state['traders'].values() for o in s['orders'].values()]
+		if placed:
+			trading_client.sync_orders(datetime.datetime.fromtimestamp(min(placed) - 60, datetime.timezone.utc))
+		positions = trading_client.get_positions()
+		open_orders = trading_client.get_open_orders()
+		for t in traders:
+			t.recover(positions, open_orders)
+		reconcile_cash(traders, trading_client.get_cash())
+		journal.commit()
+
+	if args.model or artifact:
+		# Bring the bar stores up to date off the trading thread and fill the gap they had
+		# into the bar buffers. With a registry model the data is then checked for drift.
+		def update_data():
+			update_bar_stores(STOCK_TICKERS)
+			for t in STOCK_TICKERS:
+				trading_client.seed_bars(*BarStore().read(t), symbol=t)
+
+		def refresh_data():
+			update_data()
+			return load_training_data(STOCK_TICKERS)
+
+		def swap_model(new_model):
+			trader.set_model(new_model)
+			print("--> MODEL UPDATED")
+
+		if args.model:
+			threading.Thread(target=update_data, daemon=True).start()
+		else:
+			refresh_in_background(registry, artifact, STOCK_TICKERS, refresh_data, on_done=swap_model)
 
 	ask_continue = input("\n**********\nCONFRIM TRADER START WITH THIS MODEL (y/n): ").lower()
 	if ask_continue != 'y':
 		exit(0)
 
-	tz = pytz.timezone('US/Eastern')
-	sys.stdout = Logger()
+	LOG.start()
 
-	trader.trading_loop()
\ No newline at end of file
+	if METRICS_PORT:
+		METRICS.serve(METRICS_PORT)
+
+	if ENGINE == 'ASYNC':
+		AsyncTradingEngine(traders, trading_client).run()
+	else:
+		trader.trading_loop()
+	journal.close()
+	LOG.close()
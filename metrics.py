@@ -0,0 +1,82 @@
+import numpy as np
+
+
+
+# Fraction of expected moves with the same sign as the realized ones (eval_model's "correct" trades)
+def directional_accuracy(predictions, labels):
+    predictions = np.asarray(predictions).reshape(-1)
+    labels = np.asarray(labels).reshape(-1)
+    if len(predictions) == 0:
+        return float('nan')
+    return float(np.mean(predictions * labels >= 0))
+
+
+
+# Position taken on each window: long when the prediction is up, short (or flat if long_only) otherwise
+def positions(predictions, long_only=False):
+    predictions = np.asarray(predictions, dtype=np.float64).reshape(-1)
+    return np.where(predictions > 0, 1.0, 0.0 if long_only else -1.0)
+
+
+# Per-window return of trading the predictions, in units of the labels
+def signal_returns(predictions, labels, long_only=False):
+    return positions(predictions, long_only) * np.asarray(labels, dtype=np.float64).reshape(-1)
+
+
+def sharpe_ratio(returns, periods_per_year=1):
+    returns = np.asarray(returns, dtype=np.float64)
+    std = np.std(returns)
+    if len(returns) < 2 or std == 0:
+        return float('nan')
+    return float(np.mean(returns) / std * np.sqrt(periods_per_year))
+
+
+# Mean absolute change in position per window (2 for every long/short flip)
+def turnover(predictions, long_only=False):
+    pos = positions(predictions, long_only)
+    if len(pos) < 2:
+        return 0.0
+    return float(np.mean(np.abs(np.diff(pos))))
+
+
+# Buy/sell hit counts as eval_model reports them: an expected move > 0 is a buy, and
+# it is correct when it has the same sign as the realized move
+def trade_counts(predictions, labels):
+    predictions = np.asarray(predictions).reshape(-1)
+    correct = predictions * np.asarray(labels).reshape(-1) >= 0
+    buys = predictions > 0
+    return {
+        'correct_buys': int(np.sum(buys & correct)),
+        'wrong_buys': int(np.sum(buys & ~correct)),
+        'correct_sells': int(np.sum(~buys & correct)),
+        'wrong_sells': int(np.sum(~buys & ~correct)),
+    }
+
+
+# Only the first label horizon is traded, the metrics are for that one
+def traded_column(x):
+    x = np.asarray(x)
+    return x if x.ndim < 2 else x[:, 0]
+
+
+# Predictions and labels are prices, closes the price each window's decision is made at
+# (decision_prices gives all three). Trades are long when the prediction is above that
+# close and return (label - close) / close, so none of the move the model already saw counts.
+def evaluate_predictions(predictions, labels, closes, periods_per_year=1, long_only=False):
+    closes = np.asarray(closes, dtype=np.float64).reshape(-1)
+    expected = (traded_column(predictions) - closes) / closes
+    realized = (traded_column(labels) - closes) / closes
+    returns = signal_returns(expected, realized, long_only)
+    return dict(trade_counts(expected, realized),
+                samples=len(returns),
+                directional_accuracy=directional_accuracy(expected, realized),
+                mean_return=float(np.mean(returns)) if len(returns) else float('nan'),
+                sharpe=sharpe_ratio(returns, periods_per_year),
+                turnover=turnover(expected, long_only))
+
+
+def print_evaluation(results):
+    print("")
+    print("CORRECT BUYS:  %d  |  WRONG BUYS:    %d" % (results['correct_buys'], results['wrong_buys']))
+    print("CORRECT SELLS: %d  |  WRONG SELLS:   %d" % (results['correct_sells'], results['wrong_sells']))
+    print("ACCURACY: %.3f  |  SHARPE: %.2f  |  TURNOVER: %.3f" % (results['directional_accuracy'], results['sharpe'], results['turnover']))
@@ -1,16 +1,20 @@
+import os
 import numpy as np
 import torch as th
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+import queue
 import sys
-import matplotlib.pyplot as plt
+import threading
+import time
 
 import warnings
 warnings.filterwarnings('ignore')
 
 from config_20XX import *
 from data_util import *
+from metrics import evaluate_predictions, print_evaluation
 
 
 list_to_device = lambda th_obj: [tensor.to(device) for tensor in th_obj]
@@ -56,69 +60,238 @@ def generate_model(input_shape, dropout=0.0):
 		nn.Linear(64, 32), nn.Tanh(),
 		nn.Linear(32, 16), nn.ReLU(),
 		nn.Linear(16, 8), nn.ReLU(),
-		nn.Linear(8, 1)
+		nn.Linear(8, len(LABEL_HORIZONS))
 	)
 	return model
 
 
+# Load previously saved model
+def load_model(model_path, input_shape=(POINTS_PER_PERIOD, NUM_FEATURES)):
+	model = generate_model(input_shape)
+	model.load_state_dict(th.load(model_path, map_location=device))
+	model.eval()
+	return model
+
+
+# Save model to a directory
+def save_model(model, model_dir):
+	model_path = os.path.join(model_dir, 'model.pt')
+	th.save(model.state_dict(), model_path)
+	return model_path
+
+
 # Optimizer for the model
 def get_optimizer(model):
 	optimizer = optim.SGD(model.parameters(), lr=LEARNING_RATE, momentum=MOMENTUM, nesterov=True)
 	return optimizer
 
 
-# Train the model (and validate)
+# Shuffled mini-batches over (x, y). The data is moved to the device once and each
+# epoch's batches are gathered one step ahead on a background thread. Settings left as
+# None are read from the module globals when the loader is built, so overrides of them
+# (e.g. by the training farm) apply.
+class BatchLoader:
+	def __init__(self, x, y, batch_size=None, shuffle=True, pin_memory=None, prefetch=None):
+		batch_size = BATCH_SIZE if batch_size is None else batch_size
+		pin_memory = PIN_MEMORY if pin_memory is None else pin_memory
+		prefetch = PREFETCH_BATCHES if prefetch is None else prefetch
+		to_tensor = lambda a: a if th.is_tensor(a) else th.from_numpy(np.ascontiguousarray(a))
+		x, y = to_tensor(x).float(), to_tensor(y).float()
+		if pin_memory and device.type == 'cuda':
+			x, y = x.pin_memory(), y.pin_memory()
+		self.x, self.y = x.to(device, non_blocking=True), y.to(device, non_blocking=True)
+		self.batch_size = batch_size
+		self.shuffle = shuffle
+		self.prefetch = prefetch
+
+	def __len__(self):
+		return (len(self.x) + self.batch_size - 1) // self.batch_size
+
+	@property
+	def samples(self):
+		return len(self.x)
+
+	def batches(self):
+		n = len(self.x)
+		indices = th.randperm(n, device=device) if self.shuffle else th.arange(n, device=device)
+		for i in range(len(self)):
+			batch = indices[i*self.batch_size:(i+1)*self.batch_size]
+			yield self.x.index_select(0, batch), self.y.index_select(0, batch)
+
+	def __iter__(self):
+		return prefetched(self.batches(), self.prefetch)
+
+
+# BatchLoader over the windows [lo, hi) of a window_dataset.WindowDataset, read from disk
+# a few blocks at a time instead of holding the range on the device
+class DatasetLoader:
+	def __init__(self, dataset, lo, hi, batch_size=None, shuffle=True, prefetch=None):
+		self.dataset = dataset
+		self.lo, self.hi = lo, hi
+		self.batch_size = BATCH_SIZE if batch_size is None else batch_size
+		self.shuffle = shuffle
+		self.prefetch = PREFETCH_BATCHES if prefetch is None else prefetch
+		# Reshuffled every epoch, in the same order every run
+		self.rng = np.random.default_rng(150)
+
+	def __len__(self):
+		return (self.samples + self.batch_size - 1) // self.batch_size
+
+	@property
+	def samples(self):
+		return self.hi - self.lo
+
+	def batches(self):
+		for x, y in self.dataset.batches(self.lo, self.hi, self.batch_size, self.shuffle, self.rng):
+			yield th.from_numpy(x).float().to(device, non_blocking=True), th.from_numpy(y).float().to(device, non_blocking=True)
+
+	def __iter__(self):
+		return prefetched(self.batches(), self.prefetch)
+
+
+# Run a batch generator prefetch batches ahead on a background thread. An error in the
+# generator is raised in the consumer.
+def prefetched(batches, prefetch):
+	if prefetch <= 0:
+		yield from batches
+		return
+
+	done = object()
+	q = queue.Queue(maxsize=prefetch)
+	def producer():
+		try:
+			for batch in batches:
+				q.put(batch)
+		except BaseException as e:
+			q.put(e)
+			return
+		q.put(done)
+	threading.Thread(target=producer, daemon=True).start()
+
+	while True:
+		batch = q.get()
+		if batch is done:
+			return
+		if isinstance(batch, BaseException):
+			raise batch
+		yield batch
+
+
+# Train the model (and validate), stopping once val loss has not improved for PATIENCE epochs
 def train_model(model, optimizer, train_x, train_y, val_x, val_y, loss_module=nn.L1Loss):
+	train_loader = BatchLoader(train_x, train_y)
+	val_loader = BatchLoader(val_x, val_y, batch_size=PREDICT_BATCH_SIZE, shuffle=False, prefetch=0)
+	return fit(model, optimizer, train_loader, val_loader, loss_module)
+
+
+# train_model streaming the (lo, hi) train and validation ranges of a WindowDataset
+def train_model_from_dataset(model, optimizer, dataset, train_range, val_range, loss_module=nn.L1Loss):
+	train_loader = DatasetLoader(dataset, *train_range)
+	val_loader = DatasetLoader(dataset, *val_range, batch_size=PREDICT_BATCH_SIZE, shuffle=False)
+	return fit(model, optimizer, train_loader, val_loader, loss_module)
+
+
+def fit(model, optimizer, train_loader, val_loader, loss_module=nn.L1Loss):
 	print("************** TRAINING MODEL **************")
 	loss_fn = loss_module()
-	losses = []
+	model.to(device)
+	step_model = th.compile(model) if TORCH_COMPILE else model
+
+	history = {'loss': [], 'val_loss': [], 'samples_per_sec': []}
+	best_val_loss, best_state, bad_epochs = float('inf'), None, 0
+
 	for epoch in range(EPOCHS):
-		indices = np.random.permutation(range(len(train_x)))
-		t = range(0,(len(train_x)//BATCH_SIZE)+1)
-		print("---")
-		for i in t:
-			batch_input = train_x[ indices[i*BATCH_SIZE:(i+1)*BATCH_SIZE] ]
-			batch_target = train_y[ indices[i*BATCH_SIZE:(i+1)*BATCH_SIZE] ]
-			model.to(device)
-			
-			prediction = model(batch_input)
+		model.train()
+		start = time.perf_counter()
+		total_loss = th.zeros((), device=device)
+		for batch_input, batch_target in train_loader:
+			prediction = step_model(batch_input)
 			loss = loss_fn(prediction, batch_target)
-			losses.append(loss.mean().item())
+			total_loss += loss.detach().mean() * len(batch_input)
 
-			model.zero_grad()
+			optimizer.zero_grad(set_to_none=True)
 			loss.sum().backward()
 			optimizer.step()
-			
-			if i == 0:
-				print( f"Epoch: {epoch} Loss: {np.mean(losses[-10:])}" )
-
-
-# Evaluate model
-def eval_model(stock_ticker, model, test_x, test_y, display=False):
-	predict = [model(th.unsqueeze(x, 0))[0][0].item() for x in test_x]
-	indices = list(range(len(predict)))
-
-	buys, sells = [0, 0], [0, 0]
-	all_trades = [buys, sells]
-
-	for i in range(len(predict)):
-		trade_type = int(predict[i] <= 0)
-		trade_result = int(predict[i] * test_y[i] >= 0)
-		all_trades[trade_type][trade_result] += 1
-				
-	print("")
-	print("CORRECT BUYS:  %d  |  WRONG BUYS:    %d" % (buys[1], buys[0]))
-	print("CORRECT SELLS: %d  |  WRONG SELLS:   %d" % (sells[1], sells[0]))
-
-	plt.title(stock_ticker + " Stock Prediction")
-	ax = plt.axes()
-	ax.set_xlabel("Time")
-	ax.set_ylabel("Price Deviation")
-	plt.plot(indices, [y for y in predict], 'b-', marker='.', label='Predict')
-	plt.plot(indices, [y[0] for y in test_y], 'r-', marker='.', label='Actual')
-	plt.plot(indices, [0 for _ in predict], 'k-')
-	plt.legend()
-	plt.show()
+		samples_per_sec = train_loader.samples / (time.perf_counter() - start)
+
+		model.eval()
+		with th.no_grad():
+			val_loss = sum(loss_fn(step_model(x), y).mean() * len(x) for x, y in val_loader) / max(val_loader.samples, 1)
+		train_loss = total_loss.item() / train_loader.samples
+		val_loss = float(val_loss)
+
+		history['loss'].append(train_loss)
+		history['val_loss'].append(val_loss)
+		history['samples_per_sec'].append(samples_per_sec)
+		print("Epoch: %d Loss: %.5f Val loss: %.5f (%d samples/sec)" % (epoch, train_loss, val_loss, samples_per_sec))
+
+		if val_loss < best_val_loss:
+			best_val_loss, bad_epochs = val_loss, 0
+			best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+		else:
+			bad_epochs += 1
+			if bad_epochs >= PATIENCE:
+				print("Early stopping, best val loss %.5f" % best_val_loss)
+				break
+
+	if best_state is not None:
+		model.load_state_dict(best_state)
+	model.eval()
+	return history
+
+
+# Create and train a model in one step, or keep training (fine-tune) the one given
+def new_trained_model(input_shape, train_x, train_y, val_x, val_y, model=None):
+	to_tensor = lambda a: a if th.is_tensor(a) else th.from_numpy(np.ascontiguousarray(a)).float()
+	model = model if model else generate_model(input_shape)
+	train_model(model, get_optimizer(model), to_tensor(train_x), to_tensor(train_y),
+				to_tensor(val_x), to_tensor(val_y), loss_module=EllipticParaboloidLoss)
+	model.eval()
+	return model
+
+
+# new_trained_model from the train and validation ranges of a WindowDataset
+def new_trained_model_from_dataset(dataset, train_range, val_range, model=None):
+	model = model if model else generate_model(dataset.input_shape)
+	train_model_from_dataset(model, get_optimizer(model), dataset, train_range, val_range, loss_module=EllipticParaboloidLoss)
+	model.eval()
+	return model
+
+
+# Batched inference on numpy or tensor input, returns a numpy array
+def predict(model, x, batch_size=PREDICT_BATCH_SIZE):
+	x = x if th.is_tensor(x) else th.from_numpy(np.ascontiguousarray(x)).float()
+	model_device = next(model.parameters()).device
+	model.eval()
+	with th.no_grad():
+		if len(x) == 0:
+			return np.zeros((0, 1), dtype=np.float32)
+		return th.cat([model(x[i:i + batch_size].to(model_device)).cpu() for i in range(0, len(x), batch_size)]).numpy()
+
+
+# Evaluate model, test_stats are the normalization_stats of the test windows so trades are scored in prices
+def eval_model(stock_ticker, model, test_x, test_y, test_stats, display=False):
+	test_predict = predict(model, test_x)
+	test_x = test_x.numpy() if th.is_tensor(test_x) else np.asarray(test_x)
+	test_y = test_y.numpy() if th.is_tensor(test_y) else np.asarray(test_y)
+	prices, closes = decision_prices(test_x, test_predict, test_stats)
+	labels, _ = decision_prices(test_x, test_y, test_stats)
+	results = evaluate_predictions(prices, labels, closes, WINDOWS_PER_YEAR)
+	print_evaluation(results)
+
+	if display:
+		import matplotlib.pyplot as plt
+		plt.title(stock_ticker + " Stock Prediction")
+		ax = plt.axes()
+		ax.set_xlabel("Time")
+		ax.set_ylabel("Price Deviation")
+		plt.plot(test_predict[:, 0], 'b-', marker='.', label='Predict')
+		plt.plot(test_y[:, 0], 'r-', marker='.', label='Actual')
+		plt.axhline(0, color='k')
+		plt.legend()
+		plt.show()
+
+	return results
 
 
 # Run `python3 model.py TICKER` to see how it measures up against validation data
@@ -141,4 +314,5 @@ if __name__ == '__main__':
 	optimizer = get_optimizer(model)
 	train_model(model, optimizer, train_x, train_y, val_x, val_y, loss_module=EllipticParaboloidLoss)
 
-	eval_model(stock_ticker, model, test_x, test_y, display=True)
+	test_stats = normalization_stats(stock_raw)[len(train_x) + len(val_x):]
+	eval_model(stock_ticker, model, test_x, test_y, test_stats, display=True)
@@ -0,0 +1,163 @@
+import datetime
+import importlib
+import json
+import os
+import threading
+import numpy as np
+
+from config_20XX import *
+from metrics import traded_column
+
+
+
+# Settings a saved model depends on. An artifact is only reused if these match.
+def compat_config():
+	return {
+		'MODEL_TYPE': MODEL_TYPE,
+		'POINTS_PER_PERIOD': POINTS_PER_PERIOD,
+		'NUM_FEATURES': NUM_FEATURES,
+		'FEATURES': FEATURES,
+		'LABEL_HORIZONS': LABEL_HORIZONS,
+		'INTERVAL': INTERVAL,
+		'NORMALIZATION': 'window_open_stdev',
+	}
+
+
+def backend():
+	return importlib.import_module('model_tf' if MODEL_TYPE == 'TF' else 'model_pytorch')
+
+
+# Trained models saved with the data and config they were trained under:
+#   <root>/<TICKERS>/<MODEL_TYPE>_<data start>_<data end>/{model file, meta.json}
+class ModelRegistry:
+
+	def __init__(self, root=MODEL_REGISTRY_DIR):
+		self.root = root
+
+	def key(self, stock_tickers):
+		return '+'.join(sorted(t.upper() for t in stock_tickers))
+
+	# ticker_samples is the number of windows of each ticker in stock_labels, in stock_tickers order
+	def save(self, model, stock_tickers, data_start, data_end, stock_labels, ticker_samples, metrics=None):
+		artifact_dir = os.path.join(self.root, self.key(stock_tickers), "%s_%d_%d" % (MODEL_TYPE, data_start, data_end))
+		os.makedirs(artifact_dir, exist_ok=True)
+		model_file = backend().save_model(model, artifact_dir)
+
+		meta = {
+			'tickers': sorted(t.upper() for t in stock_tickers),
+			'model_file': os.path.basename(model_file),
+			'data_start': int(data_start),
+			'data_end': int(data_end),
+			'samples': int(len(stock_labels)),
+			'tickers_stats': {t.upper(): label_stats(labels) for t, labels in zip(stock_tickers, split_tickers(stock_labels, ticker_samples))},
+			'config': compat_config(),
+			'metrics': metrics or {},
+			'created': datetime.datetime.now().isoformat(),
+		}
+		# Write meta last, an artifact without one is incomplete and ignored
+		tmp_path = os.path.join(artifact_dir, 'meta.json.tmp')
+		with open(tmp_path, 'w') as f:
+			json.dump(meta, f, indent=2)
+		os.replace(tmp_path, os.path.join(artifact_dir, 'meta.json'))
+		meta['path'] = artifact_dir
+		return meta
+
+	# Compatible artifacts for these tickers, newest data first
+	def artifacts(self, stock_tickers):
+		key_dir = os.path.join(self.root, self.key(stock_tickers))
+		if not os.path.isdir(key_dir):
+			return []
+		metas = []
+		for name in os.listdir(key_dir):
+			meta_path = os.path.join(key_dir, name, 'meta.json')
+			if not os.path.exists(meta_path):
+				continue
+			with open(meta_path) as f:
+				meta = json.load(f)
+			if meta['config'] == compat_config():
+				meta['path'] = os.path.join(key_dir, name)
+				metas.append(meta)
+		return sorted(metas, key=lambda m: (m['data_end'], m['created']), reverse=True)
+
+	def latest(self, stock_tickers):
+		metas = self.artifacts(stock_tickers)
+		return metas[0] if metas else None
+
+	def load(self, meta):
+		return backend().load_model(os.path.join(meta['path'], meta['model_file']))
+
+	# Has the label distribution of any ticker's windows seen since training moved away from
+	# that ticker's training windows?
+	def drifted(self, meta, stock_tickers, stock_labels, ticker_samples):
+		for stock_ticker, labels in zip(stock_tickers, split_tickers(stock_labels, ticker_samples)):
+			# Artifacts saved before per-ticker stats were kept have none to compare against
+			stats = meta.get('tickers_stats', {}).get(stock_ticker.upper())
+			if stats is None:
+				continue
+			new_samples = len(labels) - stats['samples']
+			if new_samples < DRIFT_MIN_SAMPLES:
+				continue
+			recent = labels[-new_samples:]
+			std = max(stats['label_std'], 1e-12)
+			z = abs(np.mean(recent) - stats['label_mean']) / (std / np.sqrt(new_samples))
+			std_ratio = np.std(recent) / std
+			if z > DRIFT_Z or not (1 / DRIFT_STD_RATIO <= std_ratio <= DRIFT_STD_RATIO):
+				print("%s labels drifted (z=%.1f, std ratio %.2f)" % (stock_ticker, z, std_ratio))
+				return True
+		return False
+
+
+# Traded (first horizon) labels of each ticker, from labels concatenated in ticker order
+def split_tickers(stock_labels, ticker_samples):
+	labels = np.asarray(traded_column(stock_labels), dtype=np.float64)
+	return np.split(labels, np.cumsum(ticker_samples)[:-1])
+
+
+def label_stats(labels):
+	return {
+		'samples': int(len(labels)),
+		'label_mean': float(np.mean(labels)) if len(labels) else 0.0,
+		'label_std': float(np.std(labels)) if len(labels) else 0.0,
+	}
+
+
+
+# Train a new model, save it, then hand it to on_done(model)
+def retrain(registry, stock_tickers, data_start, data_end, stock_dat, stock_labels, ticker_samples, on_done=None, dataset=None):
+	from data_util import partition_data
+
+	if dataset:
+		train_range, val_range, _ = dataset.splits()
+		model = backend().new_trained_model_from_dataset(dataset, train_range, val_range)
+	else:
+		train_x, train_y, _, _ = partition_data(TRAINING_SET_THRESH, stock_dat, stock_labels)
+		train_x, train_y, val_x, val_y = partition_data(TRAINING_SET_THRESH, train_x, train_y)
+		input_frame_shape = (stock_dat.shape[1], stock_dat.shape[2])
+		model = backend().new_trained_model(input_frame_shape, train_x, train_y, val_x, val_y)
+	registry.save(model, stock_tickers, data_start, data_end, stock_labels, ticker_samples)
+	if on_done:
+		on_done(model)
+
+
+# retrain in a background thread
+def retrain_in_background(registry, stock_tickers, data_start, data_end, stock_dat, stock_labels, ticker_samples, on_done=None, dataset=None):
+	thread = threading.Thread(target=retrain, daemon=True, args=(registry, stock_tickers, data_start, data_end, stock_dat,
+							  stock_labels, ticker_samples, on_done, dataset))
+	thread.start()
+	return thread
+
+
+# After a warm start from artifact: load_data() brings the data up to date and windows it
+# (returning what main.load_training_data does), then the data is checked for drift and
+# the model retrained if it has, all in a background thread so trading starts right away
+def refresh_in_background(registry, artifact, stock_tickers, load_data, on_done=None):
+	def refresh():
+		data = load_data()
+		if registry.drifted(artifact, stock_tickers, data.stock_labels, data.ticker_samples):
+			print("Data has drifted since the model was trained, retraining in the background")
+			retrain(registry, stock_tickers, data.data_start, data.data_end, data.stock_dat, data.stock_labels,
+					data.ticker_samples, on_done, data.dataset)
+
+	thread = threading.Thread(target=refresh, daemon=True)
+	thread.start()
+	return thread
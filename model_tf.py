@@ -1,10 +1,10 @@
 import os
 import sys
+import time
 import numpy as np
 import tensorflow as tf
 kb = tf.keras.backend
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-import matplotlib.pyplot as plt
 
 from config_20XX import *
 
@@ -12,9 +12,14 @@ import warnings
 warnings.filterwarnings('ignore')
 
 from data_util import *
+from metrics import evaluate_predictions, print_evaluation
 
 np.random.seed(150)
 
+# The thread pools can only be sized before TF runs its first op
+tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+
 
 
 # Custom loss function to reward correct sign
@@ -28,7 +33,13 @@ def elliptic_paraboloid_loss(x, y):
 
 # Load previously saved model
 def load_model(model_path):
-	return tf.keras.models.load_model(model_path)
+	return tf.keras.models.load_model(model_path, custom_objects={'elliptic_paraboloid_loss': elliptic_paraboloid_loss})
+
+# Save model to a directory
+def save_model(model, model_dir):
+	model_path = os.path.join(model_dir, 'model.keras')
+	model.save(model_path)
+	return model_path
 
 # Create the model
 def generate_model(input_shape):
@@ -49,53 +60,119 @@ def generate_model(input_shape):
 	    tf.keras.layers.Dense(units=32, activation='tanh', kernel_regularizer=l2(0.05)),
 	    tf.keras.layers.Dense(units=16, activation='relu', kernel_regularizer=l2(0.05)),
 	    tf.keras.layers.Dense(units=8, activation='relu', kernel_regularizer=l2(0.05)),
-	    tf.keras.layers.Dense(units=1)
+	    tf.keras.layers.Dense(units=len(LABEL_HORIZONS))
 	])
 
-	early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss',
-	                                                    patience=PATIENCE,
-	                                                    mode='min')
-
 	model.compile(loss=elliptic_paraboloid_loss,
 	                optimizer=tf.optimizers.Adam(),
-	                metrics=[elliptic_paraboloid_loss])
+	                metrics=[elliptic_paraboloid_loss],
+	                jit_compile=JIT_COMPILE)
 
 	return model
 
 
-# Train the model (and validate)
+# float32 input pipeline, reshuffled every epoch and prefetched while the model trains
+def make_dataset(x, y, batch_size=None, shuffle=True):
+	batch_size = BATCH_SIZE if batch_size is None else batch_size
+	dataset = tf.data.Dataset.from_tensor_slices((np.asarray(x, dtype=np.float32), np.asarray(y, dtype=np.float32))).cache()
+	if shuffle:
+		dataset = dataset.shuffle(min(len(x), SHUFFLE_BUFFER), seed=150, reshuffle_each_iteration=True)
+	return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+# make_dataset over the windows [lo, hi) of a window_dataset.WindowDataset, streamed from
+# disk every epoch (it is not cached, that would pull it all into memory)
+def stream_dataset(dataset, lo, hi, batch_size=None, shuffle=True):
+	batch_size = BATCH_SIZE if batch_size is None else batch_size
+	spec = (tf.TensorSpec((None,) + dataset.input_shape, tf.float32), tf.TensorSpec((None, dataset.y.shape[1]), tf.float32))
+	rng = np.random.default_rng(150)
+	batches = lambda: ((x.astype(np.float32, copy=False), y.astype(np.float32, copy=False))
+	                   for x, y in dataset.batches(lo, hi, batch_size, shuffle, rng))
+	return tf.data.Dataset.from_generator(batches, output_signature=spec).prefetch(tf.data.AUTOTUNE)
+
+
+# Wall-clock time of every epoch (validation included)
+class EpochTimer(tf.keras.callbacks.Callback):
+
+	def __init__(self, samples):
+		super().__init__()
+		self.samples = samples
+		self.seconds = []
+
+	def on_epoch_begin(self, epoch, logs=None):
+		self.start = time.perf_counter()
+
+	def on_epoch_end(self, epoch, logs=None):
+		seconds = time.perf_counter() - self.start
+		self.seconds.append(seconds)
+		logs = logs or {}
+		print("Epoch: %d Loss: %.5f Val loss: %.5f (%.2fs, %d samples/sec)" % (epoch, logs.get('loss', float('nan')),
+			logs.get('val_loss', float('nan')), seconds, self.samples / seconds))
+
+
+# Train the model (and validate), stopping once val_loss stops improving and keeping the best weights
 def train_model(model, train_x, train_y, val_x, val_y):
+	return fit(model, make_dataset(train_x, train_y),
+	           make_dataset(val_x, val_y, batch_size=PREDICT_BATCH_SIZE, shuffle=False), len(train_x))
+
+
+# train_model streaming the (lo, hi) train and validation ranges of a WindowDataset
+def train_model_from_dataset(model, dataset, train_range, val_range):
+	return fit(model, stream_dataset(dataset, *train_range),
+	           stream_dataset(dataset, *val_range, batch_size=PREDICT_BATCH_SIZE, shuffle=False), train_range[1] - train_range[0])
+
+
+def fit(model, train_data, val_data, samples):
 	print("************** TRAINING MODEL **************")
-	model.fit(train_x, train_y, epochs=MAX_EPOCHS, validation_data=(val_x, val_y))
+	early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss',
+	                                                    patience=PATIENCE,
+	                                                    mode='min',
+	                                                    restore_best_weights=True)
+	timer = EpochTimer(samples)
+	history = model.fit(train_data, epochs=MAX_EPOCHS, verbose=0, validation_data=val_data,
+	                    callbacks=[timer, early_stopping]).history
+	history = dict(history, epoch_seconds=timer.seconds)
+	print("Trained %d epochs in %.1fs" % (len(history['loss']), sum(history['epoch_seconds'])))
+	return history
+
+# Create and train a model in one step, or keep training (fine-tune) the one given
+def new_trained_model(input_shape, train_x, train_y, val_x, val_y, model=None):
+	model = model if model else generate_model(input_shape)
+	train_model(model, train_x, train_y, val_x, val_y)
+	return model
 
-# Evaluate model
-def eval_model(stock_ticker, model, test_x, test_y, display=False):
-	test_predict = model.predict(test_x)
-	indices = list(range(len(test_predict)))
+# new_trained_model from the train and validation ranges of a WindowDataset
+def new_trained_model_from_dataset(dataset, train_range, val_range, model=None):
+	model = model if model else generate_model(dataset.input_shape)
+	train_model_from_dataset(model, dataset, train_range, val_range)
+	return model
 
-	buys, sells = [0, 0], [0, 0]
-	all_trades = [buys, sells]
+# Batched inference, returns a numpy array
+def predict(model, x):
+	return model.predict(np.asarray(x, dtype=np.float32), batch_size=PREDICT_BATCH_SIZE, verbose=0)
 
-	for i in range(len(test_predict)):
-		trade_type = int(test_predict[i] <= 0)
-		trade_result = int(test_predict[i] * test_y[i] >= 0)
-		all_trades[trade_type][trade_result] += 1
-	            
-	print("")
-	print("CORRECT BUYS:  %d  |  WRONG BUYS:    %d" % (buys[1], buys[0]))
-	print("CORRECT SELLS: %d  |  WRONG SELLS:   %d" % (sells[1], sells[0]))
+# Evaluate model, test_stats are the normalization_stats of the test windows so trades are scored in prices
+def eval_model(stock_ticker, model, test_x, test_y, test_stats, display=False):
+	test_predict = predict(model, test_x)
+	prices, closes = decision_prices(test_x, test_predict, test_stats)
+	labels, _ = decision_prices(test_x, test_y, test_stats)
+	results = evaluate_predictions(prices, labels, closes, WINDOWS_PER_YEAR)
+	print_evaluation(results)
 
 	if display:
+		import matplotlib.pyplot as plt
 		plt.title(stock_ticker + " Stock Prediction")
 		ax = plt.axes()
 		ax.set_xlabel("Time")
 		ax.set_ylabel("Price Deviation")
-		plt.plot(indices, [y[0] for y in test_predict], 'b-', marker='.', label='Predict')
-		plt.plot(indices, [y[0] for y in test_y], 'r-', marker='.', label='Actual')
-		plt.plot(indices, [0 for _ in test_predict], 'k-')
+		plt.plot(test_predict[:, 0], 'b-', marker='.', label='Predict')
+		plt.plot(np.asarray(test_y)[:, 0], 'r-', marker='.', label='Actual')
+		plt.axhline(0, color='k')
 		plt.legend()
 		plt.show()
 
+	return results
+
 
 
 # Run `python3 model.py` to see how it measures up against validation data
@@ -115,4 +192,5 @@ if __name__ == '__main__':
 	model = generate_model(input_frame_shape)
 	train_model(model, train_x, train_y, val_x, val_y)
 
-	eval_model(stock_ticker, model, test_x, test_y, display=True)
\ No newline at end of file
+	test_stats = normalization_stats(stock_raw)[len(train_x) + len(val_x):]
+	eval_model(stock_ticker, model, test_x, test_y, test_stats, display=True)
\ No newline at end of file
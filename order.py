@@ -1,3 +1,5 @@
+from trade_log import LOG
+
 from config_20XX import *
 
 # Should not directly use the Order class
@@ -22,6 +24,10 @@ class Order:
 		self.filled_qty = order_info['filled_qty']
 		self.avg_price = order_info['avg_price'] if self.price_type == "MARKET" else self.limit_price
 
+		if self.filled_qty != prev_filled_shares:
+			LOG.record('order', event='filled' if self.filled_qty == self.qty else 'partial_fill', id=str(self.id),
+						symbol=self.symbol, action=self.action, qty=self.qty, filled_qty=self.filled_qty, avg_price=self.avg_price)
+
 		if self.active:
 			s = (self.action, self.filled_qty, self.qty, self.avg_price)
 			if self.filled_qty == self.qty:
@@ -44,6 +50,8 @@ class Order:
 	def place(self, client):
 		self.id = client.place_order(self.dict()).id
 		self.active = True
+		LOG.record('order', event='placed', id=str(self.id), symbol=self.symbol, action=self.action, qty=self.qty,
+					price_type=self.price_type, limit_price=getattr(self, 'limit_price', None))
 		print("--> ORDER PLACED: %s %s shares " % (self.action, self.qty), end='')
 		if isinstance(self, MarketOrder):
 			print("@ Market price")
@@ -53,7 +61,12 @@ class Order:
 
 	def cancel(self, client):
 		client.cancel_order(self.id)
+		self.cancelled()
+
+	# Mark the order cancelled once the cancel has been sent, alone or in bulk
+	def cancelled(self):
 		self.active = False
+		LOG.record('order', event='cancelled', id=str(self.id), symbol=self.symbol, action=self.action, qty=self.qty)
 		print("--> ORDER CANCELLED: %s %s shares " % (self.action, self.qty))
 
 
@@ -80,3 +93,16 @@ class LimitOrder(Order):
 		order = super().dict()
 		order["limit_price"] = self.limit_price
 		return order
+
+
+
+# Rebuild a placed order from its dict() plus the id and filled_qty it was journaled with
+def order_from_dict(order):
+	if order["price_type"] == "LIMIT":
+		placed = LimitOrder(order["symbol"], order["action"], order["limit_price"], order["qty"])
+	else:
+		placed = MarketOrder(order["symbol"], order["action"], order["qty"])
+	placed.id = order["id"]
+	placed.filled_qty = order.get("filled_qty", 0)
+	placed.active = True
+	return placed
@@ -0,0 +1,99 @@
+import datetime
+import pytz
+import time
+
+from trader import *
+
+from config_20XX import *
+
+
+
+# Runs one Trader per ticker in a single loop over one shared client (one
+# stream connection) and one shared model
+class Portfolio:
+
+	def __init__(self, stock_tickers, model, client, init_cash=1000.00, shared_cash=False, journal=None):
+		self.client = client
+		self.init_cash = init_cash
+		predictor = make_predictor(model)
+
+		if shared_cash:
+			account = CashAccount(init_cash)
+			self.traders = [Trader(t, model, client, init_cash, account, journal, predictor) for t in stock_tickers]
+		else:
+			per_trader_cash = init_cash / len(stock_tickers)
+			self.traders = [Trader(t, model, client, per_trader_cash, journal=journal, predictor=predictor) for t in stock_tickers]
+
+		self.accounts = list({id(trader.account): trader.account for trader in self.traders}.values())
+
+	# Swap a (re)trained model into every trader, exported once
+	def set_model(self, model):
+		predictor = make_predictor(model)
+		for trader in self.traders:
+			trader.set_model(model, predictor)
+
+	def value(self):
+		cash = sum(account.cash for account in self.accounts)
+		equity = sum(trader.shares * self.client.get_last_price(trader.stock_ticker) for trader in self.traders)
+		return cash + equity
+
+	def print_value(self):
+		for trader in self.traders:
+			print("[%s]" % trader.stock_ticker, end=' ')
+			trader.print_value(self.client.get_last_price(trader.stock_ticker))
+		print("PORTFOLIO VALUE = $%.2f" % self.value())
+
+	def trading_loop(self):
+
+		tz = pytz.timezone('US/Eastern')
+
+		while (1):
+			print("\n---\n%s" % datetime.datetime.now(tz).strftime("%H:%M:%S,  %m/%d/%Y"))
+
+			with METRICS.timer('market_clock'):
+				market_open = self.client.market_is_open()
+			METRICS.maybe_export()
+
+			if not market_open:
+				print("AFTER HOURS TRADING - NO ACTION")
+				self.print_value()
+
+				try:
+					time.sleep(AFTER_HOURS_SLEEP)
+				except KeyboardInterrupt:
+					self.trading_summary()
+					if self.prompt_quit():
+						break
+				continue
+
+			halted = False
+			for trader in self.traders:
+				print("[%s]" % trader.stock_ticker, end=' ')
+				if not trader.tick(*trader.get_prices()) and self.prompt_quit():
+					halted = True
+					break
+			if halted:
+				break
+
+			try:
+				time.sleep(TRADING_HOURS_SLEEP)
+			except KeyboardInterrupt:
+				self.trading_summary()
+				if self.prompt_quit():
+					break
+
+	def prompt_quit(self):
+		return self.traders[0].prompt_quit()
+
+	def trading_summary(self):
+		value = self.value()
+		print("\n\n******************** PORTFOLIO SUMMARY ********************")
+		for trader in self.traders:
+			print("%-6s SHARES = %d" % (trader.stock_ticker, trader.shares))
+		print("STARTING VALUE:  $%.2f" % self.init_cash)
+		print("ENDING VALUE:    $%.2f" % value)
+		print("")
+		r = (value/self.init_cash - 1) * 100
+		print("TOTAL'S RETURN:  %% %.2f" % r, "   🚀🚀🚀" if r > 0 else "")
+		print("***********************************************************")
+		METRICS.summary()
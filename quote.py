@@ -0,0 +1,84 @@
+import threading
+import time
+from typing import NamedTuple
+
+from config_20XX import QUOTE_MAX_AGE
+
+
+# Immutable top of book for one symbol. The stream thread publishes a new one by
+# swapping the reference, so a reader gets a consistent price/bid/ask with a single
+# load and no lock. seq goes up by one with every trade or quote.
+class Quote(NamedTuple):
+    symbol: str
+    price: float
+    bid: float
+    ask: float
+    seq: int = 0
+    timestamp: float = 0.0 # Exchange time of the latest trade or quote, epoch seconds
+    received: float = 0.0 # time.monotonic() when it was published
+
+    def age(self):
+        return time.monotonic() - self.received
+
+    def is_stale(self, max_age=QUOTE_MAX_AGE):
+        return max_age is not None and self.age() > max_age
+
+    def with_trade(self, price, timestamp):
+        return self._replace(price=price, seq=self.seq + 1, timestamp=timestamp, received=time.monotonic())
+
+    def with_quote(self, bid, ask, timestamp):
+        return self._replace(bid=bid, ask=ask, seq=self.seq + 1, timestamp=timestamp, received=time.monotonic())
+
+
+
+# Run `python3 quote.py [SECONDS]` to hammer a snapshot from a writer thread while
+# readers check that every bid/ask pair they see came from one quote
+if __name__ == '__main__':
+    import sys
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    # Every published quote has ask == bid + 1, a mixed read breaks that
+    quotes = {'AMC': Quote('AMC', 0.0, 0.0, 1.0, received=time.monotonic())}
+    bid_price, ask_price = {'AMC': 0.0}, {'AMC': 1.0}
+    stop = threading.Event()
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            quotes['AMC'] = quotes['AMC'].with_quote(float(n), float(n + 1), time.time())
+            # The same quote as two separate stores, the way the client used to keep it
+            bid_price['AMC'] = float(n)
+            ask_price['AMC'] = float(n + 1)
+
+    results = []
+
+    def reader():
+        reads, torn_snapshots, torn_separate, out_of_order, last_seq = 0, 0, 0, 0, -1
+        while not stop.is_set():
+            q = quotes['AMC']
+            torn_snapshots += q.ask != q.bid + 1
+            out_of_order += q.seq < last_seq
+            last_seq = q.seq
+            bid = bid_price['AMC']
+            ask = ask_price['AMC']
+            torn_separate += ask != bid + 1
+            reads += 1
+        results.append((reads, torn_snapshots, out_of_order, torn_separate))
+
+    # A tiny switch interval makes the interpreter swap threads between the two stores often
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    reads, torn_snapshots, out_of_order, torn_separate = map(sum, zip(*results))
+    print("%d reads of %d quotes" % (reads, quotes['AMC'].seq))
+    print("snapshot:         %d torn, %d out of order" % (torn_snapshots, out_of_order))
+    print("separate getters: %d torn" % torn_separate)
+    if torn_snapshots or out_of_order:
+        sys.exit(1)
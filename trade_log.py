@@ -0,0 +1,141 @@
+import datetime
+import json
+import os
+import pytz
+import queue
+import sys
+import threading
+import time
+
+from config_20XX import *
+
+
+
+DEBUG = 10
+INFO = 20
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO'}
+
+
+# Stdout hook and structured trade log. Callers only put records on a queue and never wait.
+# Under back-pressure debug records are dropped first (past HIGH_WATER), then other text
+# and records (past queue_size), each drop counted; order records are never dropped, they
+# always have room, so the audit trail stays complete. One background thread
+# echoes printed text to the terminal, formats the records and writes day-rolled files:
+#   <log dir>/trader_<date>.log    everything printed
+#   <log dir>/trader_<date>.jsonl  one JSON record per order, prediction and quote
+# Nothing is queued until start() is called, so backtests and scripts log nothing.
+class AsyncLogger:
+	HIGH_WATER = 0.8 # Debug records are dropped once the queue is this full
+	MAX_BATCH = 1024
+	NEVER_DROP = ('order',)
+
+	def __init__(self, log_dir=LOG_DIR, queue_size=LOG_QUEUE_SIZE):
+		self.log_dir = log_dir
+		# Unbounded so order records always fit, the limits for the rest are checked in _put
+		self.queue = queue.Queue()
+		self.queue_size = queue_size
+		self.high_water = int(queue_size * self.HIGH_WATER)
+		self.dropped = 0
+		self.dropped_lock = threading.Lock()
+
+		self.tz = pytz.timezone('US/Eastern')
+		self.terminal = None
+		self.thread = None
+		self.files = {}
+		self.rollover = 0
+
+	def start(self, capture_stdout=True):
+		if self.thread:
+			return
+		os.makedirs(self.log_dir, exist_ok=True)
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+		if capture_stdout:
+			self.terminal = sys.stdout
+			sys.stdout = self
+
+	# Write out everything queued and stop the writer thread
+	def close(self):
+		if self.thread is None:
+			return
+		if self.terminal:
+			sys.stdout = self.terminal
+		self.queue.put(None)
+		self.thread.join()
+		self.thread = None
+
+	def _put(self, item, level, kind=None):
+		if self.thread is None:
+			return
+		if kind not in self.NEVER_DROP and self.queue.qsize() >= (self.high_water if level <= DEBUG else self.queue_size):
+			with self.dropped_lock:
+				self.dropped += 1
+			return
+		self.queue.put_nowait(item)
+
+	# File-like interface so the logger can stand in for sys.stdout
+	def write(self, message):
+		self._put(('log', time.time(), message), INFO)
+		return len(message)
+
+	# The writer thread flushes the terminal after every batch
+	def flush(self):
+		pass
+
+	def record(self, kind, level=INFO, **fields):
+		self._put(('jsonl', time.time(), dict(kind=kind, level=LEVEL_NAMES[level], **fields)), level, kind)
+
+	def debug(self, kind, **fields):
+		self.record(kind, DEBUG, **fields)
+
+	def _roll(self, ts):
+		for f in self.files.values():
+			f.close()
+		now = datetime.datetime.fromtimestamp(ts, self.tz)
+		log_date = now.strftime("%m-%d-%Y")
+		self.files = {ext: open(os.path.join(self.log_dir, "trader_%s.%s" % (log_date, ext)), 'a') for ext in ['log', 'jsonl']}
+		midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+		self.rollover = self.tz.localize(midnight).timestamp()
+
+	def _write(self, kind, ts, payload):
+		if ts >= self.rollover:
+			self._roll(ts)
+		if kind == 'jsonl':
+			payload = json.dumps(dict(ts=ts, **payload), default=str) + "\n"
+		elif self.terminal:
+			self.terminal.write(payload)
+		self.files[kind].write(payload)
+
+	def _run(self):
+		reported_drops = 0
+		while True:
+			# Take everything queued so far and flush the files once per batch
+			items = [self.queue.get()]
+			try:
+				while items[-1] is not None and len(items) < self.MAX_BATCH:
+					items.append(self.queue.get_nowait())
+			except queue.Empty:
+				pass
+
+			for item in items:
+				if item is not None:
+					self._write(*item)
+			with self.dropped_lock:
+				dropped = self.dropped
+			if dropped != reported_drops:
+				self._write('jsonl', time.time(), {'kind': 'dropped', 'level': 'INFO', 'count': dropped - reported_drops})
+				reported_drops = dropped
+			for f in self.files.values():
+				f.flush()
+			if self.terminal:
+				self.terminal.flush()
+
+			if items[-1] is None:
+				for f in self.files.values():
+					f.close()
+				self.files = {}
+				self.rollover = 0
+				return
+
+
+LOG = AsyncLogger()
@@ -1,61 +1,186 @@
 import datetime
 import pytz
-import holidays
 import time
-import yfinance as yf
-import json
 
 from order import *
-from alpaca.client import TradingClient
+from inference import make_predictor
+from bar_provider import ProviderError
+from latency import METRICS
+from trade_log import LOG
 
 from config_20XX import *
-
-if MODEL_TYPE == 'TF':
-	from model_tf import *
-elif MODEL_TYPE == 'TORCH':
-	from model_pytorch import *
 from data_util import *
 
 
 
+# Cash shared by one or more traders. Buys hold cash until they fill or are
+# cancelled so traders on the same account cannot spend it twice.
+class CashAccount:
+
+	def __init__(self, cash):
+		self.cash = cash
+		self.holds = {}
+
+	def available(self):
+		return self.cash - sum(self.holds.values())
+
+	def hold(self, order, amount):
+		self.holds[order] = amount
+
+	def release(self, order):
+		self.holds.pop(order, None)
+
+
+
+# After recovery, the traders' cash (plus what their pending fills will move) can not be more
+# than the broker's. If it is, scale the accounts down to what the broker actually has.
+def reconcile_cash(traders, broker_cash):
+	accounts = list({id(trader.account): trader.account for trader in traders}.values())
+	journal_cash = sum(account.cash for account in accounts)
+	pending_cash = sum(trader.pending_fills()[1] for trader in traders)
+	if journal_cash + pending_cash > broker_cash + 0.01 and journal_cash > 0:
+		print("JOURNAL HAS $%.2f CASH, BROKER HAS $%.2f - USING THE BROKER'S" % (journal_cash + pending_cash, broker_cash))
+		scale = max(broker_cash - pending_cash, 0.0) / journal_cash
+		for account in accounts:
+			account.cash *= scale
+	return journal_cash + pending_cash
+
+
+
 class Trader:
 
-	def __init__(self, stock_ticker, model, client, init_cash=1000.00):
+	def __init__(self, stock_ticker, model, client, init_cash=1000.00, account=None, journal=None, predictor=None):
 		self.stock_ticker = stock_ticker
-		self.model = model
 		self.client = client
+		self.journal = journal
+		self.set_model(model, predictor)
 
 		self.init_cash = init_cash
-		self.cash = init_cash
+		self.account = account if account else CashAccount(init_cash)
 		self.shares = 0
 
 		self.price_target = 0.0
-		self.next_prediction_time = datetime.datetime.now()
+		self.next_prediction_time = self.client.now()
 		self.prediction_interval = datetime.timedelta(seconds=PREDICTION_INTERVAL)
+		self.conservative_const = CONSERVATIVE_CONST
+
+		self.active_orders = []
+		self.tick_start = None
+		self.quote = None
+
+	# Swap in a (re)trained model along with its low-latency predictor. Traders sharing a
+	# model should share its predictor too, building one exports the model.
+	def set_model(self, model, predictor=None):
+		self.model = model
+		self.predictor = predictor if predictor is not None else make_predictor(model)
+
+	def journal_event(self, event, **fields):
+		if self.journal:
+			self.journal.append(self.stock_ticker, event, **fields)
+
+	# Restore shares, cash, price target and open orders from the journal and reconcile them
+	# with the broker's positions ({symbol: qty}) and open orders ({id: info}), each from one
+	# bulk call. Open orders the journal never saw (placed just before a crash, before the
+	# journal was committed) are adopted along with the cash they hold.
+	def recover(self, positions=None, open_orders=None):
+		state = self.journal.trader_state(self.stock_ticker) if self.journal else None
+		if state is None:
+			return False
 
+		self.shares = state['shares']
+		self.cash += state['cash_flow']
+		self.price_target = state['price_target']
 		self.active_orders = []
+		for info in state['orders'].values():
+			order = order_from_dict(info)
+			if info.get('hold'):
+				self.account.hold(order, info['hold'])
+			self.active_orders.append(order)
+
+		if open_orders is not None:
+			known = set(str(order.id) for order in self.active_orders)
+			for order_id, info in open_orders.items():
+				if info['symbol'] == self.stock_ticker and str(order_id) not in known:
+					self.adopt_order(info)
+
+		if positions is not None:
+			# Fills that happened while we were down are applied by the next tick as usual
+			pending, _ = self.pending_fills()
+			broker_shares = positions.get(self.stock_ticker, 0)
+			if self.shares + pending != broker_shares:
+				print("JOURNAL HAS %d SHARES, BROKER HAS %d - USING THE BROKER'S" % (self.shares + pending, broker_shares))
+				self.shares = max(broker_shares - pending, 0)
+
+		print("RECOVERED %s: SHARES = %d, CASH = $%.2f, %d OPEN ORDERS" % (self.stock_ticker, self.shares, self.cash, len(self.active_orders)))
+		return True
+
+	# Take over an open broker order the journal does not have, holding the cash a buy needs
+	def adopt_order(self, info):
+		order = order_from_dict(dict(info, symbol=self.stock_ticker, filled_qty=0))
+		if order.action == "BUY":
+			price = order.limit_price if isinstance(order, LimitOrder) else self.client.get_snapshot(self.stock_ticker).ask
+			self.account.hold(order, order.qty * price)
+		self.journal_event('order', order=dict(order.dict(), id=order.id, filled_qty=order.filled_qty,
+									hold=self.account.holds.get(order, 0.0), placed=time.time()))
+		self.active_orders.append(order)
+		print("ADOPTED UNJOURNALED ORDER %s: %s %d shares" % (order.id, order.action, order.qty))
+
+	# (shares, cash) the broker has filled on the open orders that are not applied yet
+	def pending_fills(self):
+		shares, cash = 0, 0.0
+		for order in self.active_orders:
+			info = self.client.get_order_info(order.id)
+			order_type = 1 if order.action == "BUY" else -1
+			price = info['avg_price'] if order.price_type == "MARKET" else order.limit_price
+			shares += (info['filled_qty'] - order.filled_qty) * order_type
+			cash -= (info['filled_qty'] - order.filled_qty) * price * order_type
+		return shares, cash
+
+	@property
+	def cash(self):
+		return self.account.cash
+
+	@cash.setter
+	def cash(self, cash):
+		self.account.cash = cash
+
+	# Last trade, bid and ask from one snapshot so they always belong together
+	def get_prices(self):
+		self.quote = self.client.get_snapshot(self.stock_ticker)
+		return self.quote.price, self.quote.bid, self.quote.ask
 
 	def get_stock_prediction(self):
-		# Pull the most recent stock data 
-		stock_raw, stock_dat = recent_stock_data(self.stock_ticker)
-		stock_predict = self.model.predict(stock_dat) * CONSERVATIVE_CONST
+		# Use the bars built from the stream, fall back to pulling the most recent stock data
+		with METRICS.timer('data_fetch'):
+			stock_raw = self.client.get_bar_window(self.stock_ticker)
+			if stock_raw is None:
+				stock_raw, stock_dat = recent_stock_data(self.stock_ticker)
+			else:
+				stock_dat = normalize_data(np.array(stock_raw, copy=True), [[0]])
+		with METRICS.timer('inference'):
+			stock_predict = self.predictor.predict(stock_dat) * self.conservative_const
 		stock_predict = unnormalize_data(stock_raw, stock_predict, [[0]])[0]
-		return round(stock_predict[0][0], 2)
+		return round(float(stock_predict[0][0]), 2)
 
 	def place_order(self, order):
-		order.place(self.client)
+		with METRICS.timer('order_submit'):
+			order.place(self.client)
+		self.journal_event('order', order=dict(order.dict(), id=order.id, filled_qty=order.filled_qty,
+									hold=self.account.holds.get(order, 0.0), placed=time.time()))
+		if self.tick_start is not None:
+			METRICS.record('tick_to_order', time.perf_counter() - self.tick_start)
 		self.active_orders.append(order)
 
 	def update_prediction_time(self, curr_bid_price, curr_ask_price):
 		# Make decision based on previous prediction
-		if (self.shares == 0 or self.cash >= curr_ask_price) and curr_ask_price <= self.price_target:
+		if (self.shares == 0 or self.account.available() >= curr_ask_price) and curr_ask_price <= self.price_target:
 			# See if it's a good time to buy
 			print("PRICE IS BELOW TARGET OF $%.3f" % self.price_target, end=' | ')
-			self.next_prediction_time = datetime.datetime.now()
+			self.next_prediction_time = self.client.now()
 		elif self.shares > 0 and curr_bid_price >= self.price_target:
 			# See if it's a good time to sell
 			print("PRICE IS ABOVE TARGET OF $%.3f" % self.price_target, end=' | ')
-			self.next_prediction_time = datetime.datetime.now()
+			self.next_prediction_time = self.client.now()
 		elif self.price_target:
 			print("PRICE TARGET $%.3f NOT YET MET" % self.price_target)
 
@@ -70,58 +195,124 @@ class Trader:
 			order_type = 1 if order.action == "BUY" else -1
 			self.shares += new_filled_shares * order_type
 			self.cash -= new_filled_shares * order.avg_price * order_type
+			self.journal_event('fill', order_id=order.id, shares=new_filled_shares * order_type,
+								cash=-new_filled_shares * order.avg_price * order_type)
 
+			self.account.release(order)
 			self.active_orders.remove(order)
 
 		return filled
 
 	def check_active_orders_filled(self):
 		for order in list(self.active_orders):
-			if self.check_active_order_filled(order):
-				if order.is_filled(self.client) and order.action == "BUY":
+			with METRICS.timer('fill_check'):
+				filled = self.check_active_order_filled(order)
+			if filled:
+				if order.action == "BUY":
 					# Place a limit sell order at 1 cent above avg_price to make a profit
 					limit_price = round(order.avg_price + 0.01, 2)
 					limit_order = LimitOrder(self.stock_ticker, "SELL", limit_price, order.qty)
 					self.place_order(limit_order)
 				elif isinstance(order, LimitOrder):
-					self.next_prediction_time = datetime.datetime.now()
+					self.next_prediction_time = self.client.now()
 
 	def act(self, curr_bid_price, curr_ask_price):
 		# Make a new prediction for the stock
-		self.price_target = self.get_stock_prediction()
+		try:
+			self.price_target = self.get_stock_prediction()
+		except ProviderError as e:
+			# No bars this tick, keep the last target and try again on the next one
+			print("NO NEW PREDICTION:  %s" % e)
+			return
 		print("NEW PREDICTION = $%.3f" % self.price_target)
-		self.next_prediction_time = datetime.datetime.now() + self.prediction_interval
+		self.journal_event('target', price_target=self.price_target)
+		LOG.record('prediction', symbol=self.stock_ticker, price_target=self.price_target, bid=curr_bid_price, ask=curr_ask_price)
+		self.next_prediction_time = self.client.now() + self.prediction_interval
 
 		if self.price_target < curr_bid_price and self.shares > 0:
-			# Cancel all active orders
+			# Cancel all of our active orders at once, the cancels are confirmed by order updates on the stream
+			order_ids = self.client.cancel_orders([order.id for order in self.active_orders])
 			for active_order in self.active_orders:
-				active_order.cancel(self.client)
-				self.check_active_order_filled(active_order)
-			self.active_orders = []
+				active_order.cancelled()
+			self.client.wait_orders_closed(order_ids)
 
-			while self.client.get_active_order_ids():
-				time.sleep(0.5)
+			for active_order in list(self.active_orders):
+				if not self.check_active_order_filled(active_order):
+					self.journal_event('close', order_id=active_order.id)
+				self.account.release(active_order)
+			self.active_orders = []
 
 			if self.shares > 0:
 				# Sell all shares
 				self.place_order( MarketOrder(self.stock_ticker, "SELL", self.shares) )
 		elif self.price_target > curr_ask_price:
-			qty = int(self.cash // curr_ask_price)
+			qty = int(self.account.available() // curr_ask_price)
 			if qty > 0:
 				order = MarketOrder(self.stock_ticker, "BUY", qty)
+				self.account.hold(order, qty * curr_ask_price)
 				self.place_order(order)
 
+	# One pass of the trading logic, returns False if the trader failed validation
+	def tick(self, curr_price, curr_bid_price, curr_ask_price):
+		self.tick_start = time.perf_counter()
+		try:
+			return self._tick(curr_price, curr_bid_price, curr_ask_price)
+		finally:
+			METRICS.record('tick', time.perf_counter() - self.tick_start)
+			self.tick_start = None
+			if self.journal:
+				self.journal.commit()
+
+	def _tick(self, curr_price, curr_bid_price, curr_ask_price):
+		LOG.debug('quote', symbol=self.stock_ticker, price=curr_price, bid=curr_bid_price, ask=curr_ask_price)
+		print("LAST TRADE = $%.2f | BID = $%.2f | ASK = $%.2f" % (curr_price, curr_bid_price, curr_ask_price))
+
+		try:
+			self.validate_trader(curr_bid_price, curr_ask_price)
+		except:
+			print("Trader validation went wrong:\n  Shares: %d\n   Cash: $%.2f" % (self.shares, self.cash))
+			return False
+
+		# Check if previous order was filled
+		order_filled = self.check_active_orders_filled()
+		if order_filled:
+			return True
+
+		# Fills are still checked on an old quote, but it is not traded on
+		if self.quote and self.quote.is_stale():
+			print("NO ACTION:  LAST QUOTE IS %.0fs OLD" % self.quote.age())
+			return True
+
+		if not any([order for order in self.active_orders if isinstance(order, MarketOrder)]):
+			# See if it's time for a new prediction
+			self.update_prediction_time(curr_bid_price, curr_ask_price)
+
+		if self.next_prediction_time < self.client.now():
+			# Act on the information
+			self.act(curr_bid_price, curr_ask_price)
+		else:
+			if self.price_target <= curr_ask_price:
+				print("NO ACTION:  PRICE TARGET ≤ ASK")
+			elif self.price_target >= curr_bid_price:
+				print("NO ACTION:  PRICE TARGET ≥ BID")
+
+		self.print_value(curr_price)
+		return True
+
 	def trading_loop(self):
 
 		tz = pytz.timezone('US/Eastern')
 
 		while (1):
 			print("\n---\n%s" % datetime.datetime.now(tz).strftime("%H:%M:%S,  %m/%d/%Y"))
-			curr_price = self.client.get_last_price()
-			curr_bid_price = self.client.get_last_bid()
-			curr_ask_price = self.client.get_last_ask()
+			with METRICS.timer('quotes'):
+				curr_price, curr_bid_price, curr_ask_price = self.get_prices()
 
-			if not self.client.market_is_open():
+			with METRICS.timer('market_clock'):
+				market_open = self.client.market_is_open()
+			METRICS.maybe_export()
+
+			if not market_open:
 				print("AFTER HOURS TRADING - NO ACTION")
 				self.print_value(curr_price)
 
@@ -130,44 +321,21 @@ class Trader:
 					pass
 				except KeyboardInterrupt:
 					self.trading_summary(curr_price)
+					METRICS.summary()
 					if self.prompt_quit():
 						break
 				continue
 
-			print("LAST TRADE = $%.2f | BID = $%.2f | ASK = $%.2f" % (curr_price, curr_bid_price, curr_ask_price))
-
-			try:
-				self.validate_trader(curr_bid_price, curr_ask_price)
-			except:
-				print("Trader validation went wrong:\n  Shares: %d\n   Cash: $%.2f" % (self.shares, self.cash))
+			if not self.tick(curr_price, curr_bid_price, curr_ask_price):
 				if self.prompt_quit():
 					break
 				continue
 
-			# Check if previous order was filled
-			order_filled = self.check_active_orders_filled()
-			if order_filled:
-				continue
-
-			if not any([order for order in self.active_orders if isinstance(order, MarketOrder)]):
-				# See if it's time for a new prediction
-				self.update_prediction_time(curr_bid_price, curr_ask_price)
-
-			if self.next_prediction_time < datetime.datetime.now():
-				# Act on the information
-				self.act(curr_bid_price, curr_ask_price)
-			else:
-				if self.price_target <= curr_ask_price:
-					print("NO ACTION:  PRICE TARGET ≤ ASK")
-				elif self.price_target >= curr_bid_price:
-					print("NO ACTION:  PRICE TARGET ≥ BID")
-					
-			self.print_value(curr_price)
-
 			try:
 				time.sleep(TRADING_HOURS_SLEEP)
 			except KeyboardInterrupt:
 				self.trading_summary(curr_price)
+				METRICS.summary()
 				if self.prompt_quit():
 					break
 
@@ -0,0 +1,159 @@
+import contextlib
+import csv
+import datetime
+import importlib
+import itertools
+import multiprocessing as mp
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from config_20XX import *
+from data_util import *
+from metrics import directional_accuracy, traded_column
+
+
+
+# Per-worker state, set up once by init_worker
+_backend = None
+_shared = {}
+
+
+# Copy an array into a shared memory block, returns (block, descriptor for workers)
+def share_array(arr):
+	arr = np.ascontiguousarray(arr)
+	block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+	np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+	return block, (block.name, arr.shape, arr.dtype.str)
+
+
+def attach_array(desc):
+	name, shape, dtype = desc
+	if name not in _shared:
+		_shared[name] = shared_memory.SharedMemory(name=name)
+	return np.ndarray(shape, dtype=np.dtype(dtype), buffer=_shared[name].buf)
+
+
+# Pin the intra-op thread pools before the backend is imported, then import it
+def init_worker(threads):
+	global _backend
+	for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS']:
+		os.environ[var] = str(threads)
+	os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+
+	if MODEL_TYPE == 'TF':
+		_backend = importlib.import_module('model_tf')
+		_backend.tf.config.threading.set_intra_op_parallelism_threads(threads)
+		_backend.tf.config.threading.set_inter_op_parallelism_threads(1)
+	elif MODEL_TYPE == 'TORCH':
+		_backend = importlib.import_module('model_pytorch')
+		_backend.th.set_num_threads(threads)
+		_backend.th.set_num_interop_threads(1)
+
+
+# Backend module (model_tf or model_pytorch) init_worker imported in this worker
+def worker_backend():
+	if _backend is None:
+		raise RuntimeError("init_worker has not run in this process")
+	return _backend
+
+
+def predict(model, x):
+	return _backend.predict(model, x)
+
+
+# Train one (ticker, hyperparameters) job on the shared dataset for that ticker
+def train_job(stock_ticker, data, params):
+	# Hyperparameters are module globals of the backend, override them for this job
+	for k, v in params.items():
+		setattr(_backend, k, v)
+
+	stock_dat, stock_labels = attach_array(data[0]), attach_array(data[1])
+	train_x, train_y, test_x, test_y = partition_data(TRAINING_SET_THRESH, stock_dat, stock_labels)
+	train_x, train_y, val_x, val_y = partition_data(TRAINING_SET_THRESH, train_x, train_y)
+	input_frame_shape = (stock_dat.shape[1], stock_dat.shape[2])
+
+	start = time.perf_counter()
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		model = _backend.generate_model(input_frame_shape)
+		if MODEL_TYPE == 'TF':
+			_backend.train_model(model, train_x, train_y, val_x, val_y)
+			loss_fn = _backend.elliptic_paraboloid_loss
+		else:
+			th = _backend.th
+			to_tensor = lambda a: th.from_numpy(np.ascontiguousarray(a)).float()
+			_backend.train_model(model, _backend.get_optimizer(model), to_tensor(train_x), to_tensor(train_y),
+								to_tensor(val_x), to_tensor(val_y), loss_module=_backend.EllipticParaboloidLoss)
+			model.eval()
+			loss_fn = _backend.EllipticParaboloidLoss()
+	train_seconds = time.perf_counter() - start
+
+	val_predict = predict(model, val_x)
+	# Up or down from the close the decision is made at, as eval_model scores it
+	val_closes = val_x[:, -1, DECISION_FEATURE]
+	return dict(params, ticker=stock_ticker, samples=len(train_x),
+				val_loss=float(np.mean(loss_fn(val_predict, val_y))),
+				directional_accuracy=directional_accuracy(traded_column(val_predict) - val_closes, traded_column(val_y) - val_closes),
+				train_seconds=train_seconds)
+
+
+def param_grid(grid):
+	keys = sorted(grid)
+	return [dict(zip(keys, values)) for values in itertools.product(*[grid[k] for k in keys])]
+
+
+# Fan (ticker x hyperparameter) jobs out over a process pool, returns one result row per job
+def run_farm(stock_tickers, grid=FARM_GRID, workers=FARM_WORKERS, threads=FARM_THREADS_PER_WORKER):
+	blocks, datasets = [], {}
+	try:
+		update_bar_stores(stock_tickers)
+		for stock_ticker in stock_tickers:
+			_, stock_dat, stock_labels = model_stock_data(stock_ticker, update=False)
+			dat_block, dat_desc = share_array(stock_dat)
+			labels_block, labels_desc = share_array(stock_labels)
+			blocks += [dat_block, labels_block]
+			datasets[stock_ticker] = (dat_desc, labels_desc)
+
+		jobs = [(t, datasets[t], params) for t in stock_tickers for params in param_grid(grid)]
+		print("Training %d jobs on %d workers x %d threads" % (len(jobs), workers, threads))
+
+		# Spawn so each worker gets a fresh backend (TF and torch are not fork safe)
+		ctx = mp.get_context('spawn')
+		with ProcessPoolExecutor(workers, mp_context=ctx, initializer=init_worker, initargs=(threads,)) as pool:
+			futures = [pool.submit(train_job, *job) for job in jobs]
+			results = []
+			for future in futures:
+				results.append(future.result())
+				r = results[-1]
+				print("%-6s %s  val_loss=%.4f  acc=%.3f  (%.1fs)" % (r['ticker'],
+					{k: r[k] for k in grid}, r['val_loss'], r['directional_accuracy'], r['train_seconds']))
+		return results
+	finally:
+		for block in blocks:
+			block.close()
+			block.unlink()
+
+
+def write_results(results, path=None):
+	if path is None:
+		path = os.path.join(FARM_RESULTS_DIR, "train_farm_%s.csv" % datetime.datetime.now().strftime("%m-%d-%Y_%H%M%S"))
+	os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+	with open(path, 'w', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+		writer.writeheader()
+		writer.writerows(results)
+	return path
+
+
+
+# Run `python3 train_farm.py TICKER [TICKER ...]` to train the FARM_GRID for every ticker
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print('ERROR: Need to specify at least one ticker')
+		exit(1)
+
+	results = run_farm([t.upper() for t in sys.argv[1:]])
+	print("Results written to %s" % write_results(results))
@@ -0,0 +1,115 @@
+import contextlib
+import datetime
+import multiprocessing as mp
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from config_20XX import *
+from data_util import *
+from metrics import evaluate_predictions, print_evaluation
+import train_farm
+
+
+
+# (train_lo, train_hi, test_lo, test_hi) window index ranges for walk-forward folds.
+# The first train_fraction of the windows is only trained on, the rest is cut into
+# `folds` consecutive test blocks. Training is the train_fraction-sized block just
+# before each test block (or everything before it if expanding), leaving out the
+# window whose label is the first test window.
+def walk_forward_folds(n, folds=WALK_FORWARD_FOLDS, train_fraction=WALK_FORWARD_TRAIN_FRACTION, expanding=WALK_FORWARD_EXPANDING):
+	train_size = int(n * train_fraction)
+	test_size = (n - train_size) // folds
+	if train_size < 2 or test_size < 1:
+		raise ValueError("%d windows are not enough for %d folds" % (n, folds))
+
+	ranges = []
+	for k in range(folds):
+		test_lo = train_size + k * test_size
+		train_hi = test_lo - 1
+		train_lo = 0 if expanding else max(train_hi - train_size, 0)
+		ranges.append((train_lo, train_hi, test_lo, test_lo + test_size))
+	return ranges
+
+
+# Train on each fold's training range and predict its test range. With fine_tune the
+# folds run in order and each one keeps training the previous fold's model.
+def fold_job(data, folds, fine_tune=False):
+	stock_dat, stock_labels = train_farm.attach_array(data[0]), train_farm.attach_array(data[1])
+	input_frame_shape = (stock_dat.shape[1], stock_dat.shape[2])
+	backend, model, results = train_farm.worker_backend(), None, []
+
+	for train_lo, train_hi, test_lo, test_hi in folds:
+		train_x, train_y, val_x, val_y = partition_data(TRAINING_SET_THRESH, stock_dat[train_lo:train_hi], stock_labels[train_lo:train_hi])
+		start = time.perf_counter()
+		with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+			model = backend.new_trained_model(input_frame_shape, train_x, train_y, val_x, val_y, model=model if fine_tune else None)
+		train_seconds = time.perf_counter() - start
+		results.append((test_lo, test_hi, backend.predict(model, stock_dat[test_lo:test_hi]), train_seconds))
+	return results
+
+
+# Returns one metrics row per fold plus the metrics over every test window together
+def run_walk_forward(stock_ticker, folds=None, fine_tune=False, workers=FARM_WORKERS, threads=FARM_THREADS_PER_WORKER):
+	stock_raw, stock_dat, stock_labels = model_stock_data(stock_ticker)
+	folds = folds if folds else walk_forward_folds(len(stock_dat))
+	blocks = []
+	try:
+		dat_block, dat_desc = train_farm.share_array(stock_dat)
+		labels_block, labels_desc = train_farm.share_array(stock_labels)
+		blocks = [dat_block, labels_block]
+		data = (dat_desc, labels_desc)
+
+		# Independent folds run in parallel, fine-tuned ones depend on each other
+		jobs = [folds] if fine_tune else [[fold] for fold in folds]
+		workers = min(workers, len(jobs))
+		print("Walk-forward over %d folds of %s on %d workers x %d threads" % (len(folds), stock_ticker, workers, threads))
+
+		ctx = mp.get_context('spawn')
+		with ProcessPoolExecutor(workers, mp_context=ctx, initializer=train_farm.init_worker, initargs=(threads,)) as pool:
+			futures = [pool.submit(fold_job, data, job, fine_tune) for job in jobs]
+			fold_results = [r for future in futures for r in future.result()]
+	finally:
+		for block in blocks:
+			block.close()
+			block.unlink()
+
+	# Labels and predictions are normalized per window, score them in prices against the
+	# close each window's decision is made at
+	stats = normalization_stats(stock_raw)
+	rows, scored = [], []
+	for (train_lo, train_hi, _, _), (test_lo, test_hi, predictions, train_seconds) in zip(folds, fold_results):
+		test_dat, test_stats = stock_dat[test_lo:test_hi], stats[test_lo:test_hi]
+		prices, closes = decision_prices(test_dat, predictions, test_stats)
+		labels, _ = decision_prices(test_dat, stock_labels[test_lo:test_hi], test_stats)
+		scored.append((prices, labels, closes))
+		row = evaluate_predictions(prices, labels, closes, WINDOWS_PER_YEAR)
+		rows.append(dict(row, ticker=stock_ticker, train_lo=train_lo, train_hi=train_hi, test_lo=test_lo, test_hi=test_hi,
+						train_seconds=train_seconds))
+
+	overall = evaluate_predictions(*[np.concatenate(arrays) for arrays in zip(*scored)], WINDOWS_PER_YEAR)
+	return rows, overall
+
+
+def print_folds(rows):
+	print("%-6s %12s %12s %8s %8s %8s %8s %8s" % ("TICKER", "TRAIN", "TEST", "ACC", "SHARPE", "TURNOVER", "RETURN", "SECONDS"))
+	for r in rows:
+		print("%-6s %5d-%-6d %5d-%-6d %8.3f %8.2f %8.3f %8.4f %8.1f" % (r['ticker'], r['train_lo'], r['train_hi'], r['test_lo'],
+			r['test_hi'], r['directional_accuracy'], r['sharpe'], r['turnover'], r['mean_return'], r['train_seconds']))
+
+
+
+# Run `python3 walk_forward.py TICKER [--fine-tune]` to validate the model over rolling folds
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print('ERROR: Need to specify a ticker')
+		exit(1)
+
+	stock_ticker = sys.argv[1].upper()
+	rows, overall = run_walk_forward(stock_ticker, fine_tune='--fine-tune' in sys.argv)
+	print_folds(rows)
+	print_evaluation(overall)
+	path = os.path.join(FARM_RESULTS_DIR, "walk_forward_%s_%s.csv" % (stock_ticker, datetime.datetime.now().strftime("%m-%d-%Y_%H%M%S")))
+	print("Results written to %s" % train_farm.write_results(rows, path))
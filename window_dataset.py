@@ -0,0 +1,197 @@
+import json
+import os
+import shutil
+import numpy as np
+
+from config_20XX import *
+from data_util import normalize_data
+from window_util import window_data, window_labels, normalization_stats
+from features import compute_features
+from bar_store import BarStore
+
+
+
+# Windowed, normalized training samples on disk, memory-mapped on read:
+#   x.bin     - (N, POINTS_PER_PERIOD, NUM_FEATURES) windows, as model_stock_data returns them
+#   y.bin     - (N, len(LABEL_HORIZONS)) labels
+#   stats.bin - (N, 2) open and open-centred stdev each window was normalized with
+#   meta.json - shapes, dtype, the config they were built under and where each ticker starts
+# Tickers follow each other in the order given, like the concatenation in main.py.
+# Splits are index ranges into the file and batches are read from it as they are needed,
+# so memory stays flat however much history there is.
+class WindowDataset:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.x = self._open('x.bin', self.meta['x_shape'])
+        self.y = self._open('y.bin', self.meta['y_shape'])
+        self.stats = self._open('stats.bin', self.meta['stats_shape'])
+
+    # An empty file cannot be mapped
+    def _open(self, name, shape):
+        dtype = np.dtype(self.meta['dtype'])
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=tuple(shape))
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def input_shape(self):
+        return self.x.shape[1:]
+
+    # (train, validation, test) index ranges, the same split as partition_data twice over
+    def splits(self, thresh=TRAINING_SET_THRESH):
+        n = len(self)
+        split = int(n * thresh)
+        train_split = int(split * thresh)
+        return (0, train_split), (train_split, split), (split, n)
+
+    # Mini-batches of the windows in [lo, hi). Shuffling permutes blocks of
+    # DATASET_BLOCK_WINDOWS consecutive windows, reads DATASET_SHUFFLE_BLOCKS of them at a
+    # time and shuffles the windows among those, so reads stay sequential and at most
+    # DATASET_BLOCK_WINDOWS * DATASET_SHUFFLE_BLOCKS windows are in memory. Pass the same
+    # rng every epoch to get a new order each time, the default is seeded like the rest of the repo.
+    def batches(self, lo, hi, batch_size, shuffle=True, rng=None):
+        rng = rng if rng is not None else np.random.default_rng(150)
+        starts = np.arange(lo, hi, DATASET_BLOCK_WINDOWS)
+        if shuffle:
+            rng.shuffle(starts)
+        group = DATASET_SHUFFLE_BLOCKS if shuffle else 1
+
+        for g in range(0, len(starts), group):
+            blocks = [slice(s, min(s + DATASET_BLOCK_WINDOWS, hi)) for s in starts[g:g + group]]
+            x = np.concatenate([self.x[b] for b in blocks])
+            y = np.concatenate([self.y[b] for b in blocks])
+            if shuffle:
+                order = rng.permutation(len(x))
+                x, y = x[order], y[order]
+            for i in range(0, len(x), batch_size):
+                yield x[i:i + batch_size], y[i:i + batch_size]
+
+
+# Settings the stored windows depend on, a dataset built under others is rebuilt
+def dataset_config():
+    return {
+        'POINTS_PER_PERIOD': POINTS_PER_PERIOD,
+        'FEATURES': FEATURES,
+        'LABEL_HORIZONS': LABEL_HORIZONS,
+        'INTERVAL': INTERVAL,
+        'NORMALIZATION': 'window_open_stdev',
+    }
+
+
+def dataset_path(stock_tickers, root=DATASET_DIR):
+    return os.path.join(root, '_'.join(t.upper() for t in stock_tickers))
+
+
+# Build (or reuse, if the bar store has not changed since: same last bar and same number
+# of bars per ticker) the dataset of the tickers' stored bars. Windows are written DATASET_CHUNK_WINDOWS at a time, only the features of
+# one ticker and one chunk of windows are ever in memory.
+def build_dataset(stock_tickers, root=DATASET_DIR, store=None, chunk=DATASET_CHUNK_WINDOWS):
+    store = store if store else BarStore()
+    path = dataset_path(stock_tickers, root)
+    source = {'tickers': list(stock_tickers), 'last_times': [store.last_time(t) for t in stock_tickers],
+              'sizes': [store.size(t) for t in stock_tickers], 'config': dataset_config(), 'dtype': np.dtype(DTYPE).str}
+    try:
+        dataset = WindowDataset(path)
+        if all(dataset.meta[k] == v for k, v in source.items()):
+            return dataset
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Windows per ticker, the same trimming as window_data and clean_data
+    horizon = max(LABEL_HORIZONS)
+    windows = [store.size(t) // POINTS_PER_PERIOD for t in stock_tickers]
+    counts = [n - horizon if n > horizon else n for n in windows]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(int).tolist()
+
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    x_shape = (offsets[-1], POINTS_PER_PERIOD, NUM_FEATURES)
+    y_shape = (offsets[-1], len(LABEL_HORIZONS))
+    stats_shape = (offsets[-1], 2)
+    x = np.memmap(os.path.join(tmp, 'x.bin'), dtype=DTYPE, mode='w+', shape=x_shape) if offsets[-1] else np.zeros(x_shape, DTYPE)
+    y = np.memmap(os.path.join(tmp, 'y.bin'), dtype=DTYPE, mode='w+', shape=y_shape) if offsets[-1] else np.zeros(y_shape, DTYPE)
+    stats = np.memmap(os.path.join(tmp, 'stats.bin'), dtype=DTYPE, mode='w+', shape=stats_shape) if offsets[-1] else np.zeros(stats_shape, DTYPE)
+
+    for stock_ticker, n_windows, count, offset in zip(stock_tickers, windows, counts, offsets):
+        _, stock_bars = store.read(stock_ticker)
+        stock_raw = compute_features(stock_bars)
+        r = len(stock_raw) % POINTS_PER_PERIOD
+        for lo in range(0, count, chunk):
+            hi = min(lo + chunk, count)
+            # The windows after the chunk are only there to label its last ones
+            stock_dat = window_data(stock_raw[r + lo * POINTS_PER_PERIOD:r + min(hi + horizon, n_windows) * POINTS_PER_PERIOD])
+            stock_labels = window_labels(stock_dat)[:hi - lo]
+            stock_dat = stock_dat[:hi - lo]
+            stats[offset + lo:offset + hi] = normalization_stats(stock_dat)
+            x[offset + lo:offset + hi] = normalize_data(stock_dat, stock_labels)
+            y[offset + lo:offset + hi] = stock_labels
+        del stock_raw
+
+    for arr in (x, y, stats):
+        if isinstance(arr, np.memmap):
+            arr.flush()
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(dict(source, x_shape=x_shape, y_shape=y_shape, stats_shape=stats_shape, offsets=offsets), f)
+    del x, y, stats
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return WindowDataset(path)
+
+
+
+# Run `python3 window_dataset.py [YEARS]` to build a dataset from a made-up bar history,
+# check it against model_stock_data's arrays and report the peak memory of building it
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import time
+    import tracemalloc
+    from data_util import clean_data
+
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    n = int(years * 252 * 390 * 60 / INTERVAL_SECONDS)
+    root = tempfile.mkdtemp()
+    store = BarStore(os.path.join(root, 'bars'))
+    rng = np.random.default_rng(0)
+    for stock_ticker in ['AAA', 'BBB']:
+        close = 10 * np.exp(np.cumsum(rng.normal(0, 1e-3, n)))
+        bars = np.column_stack([close, close * 1.001, close * 0.999, close, rng.integers(1, 1000, n)])
+        store.append(stock_ticker, 1_000_000_000 + INTERVAL_SECONDS * np.arange(n), bars)
+        del bars, close
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    dataset = build_dataset(['AAA', 'BBB'], os.path.join(root, 'datasets'), store)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = dataset.x.nbytes + dataset.y.nbytes
+    print("%d windows (%.0f MB on disk) built in %.1fs, peak memory %.0f MB" % (len(dataset), size / 2**20, seconds, peak / 2**20))
+
+    # The same arrays the in-memory path builds
+    expected_dat, expected_labels, expected_stats = [], [], []
+    for stock_ticker in ['AAA', 'BBB']:
+        stock_raw, stock_labels = clean_data(compute_features(store.read(stock_ticker)[1]))
+        expected_stats.append(normalization_stats(stock_raw))
+        expected_dat.append(normalize_data(np.array(stock_raw, copy=True), stock_labels))
+        expected_labels.append(stock_labels)
+    identical = (np.array_equal(dataset.x, np.concatenate(expected_dat)) and np.array_equal(dataset.y, np.concatenate(expected_labels))
+                 and np.array_equal(dataset.stats, np.concatenate(expected_stats)))
+    print("identical to model_stock_data:", identical)
+
+    train, val, test = dataset.splits()
+    start = time.perf_counter()
+    for x, y in dataset.batches(*train, batch_size=32):
+        pass
+    print("one shuffled pass over %d training windows in %.2fs" % (train[1] - train[0], time.perf_counter() - start))
+    shutil.rmtree(root)
+    if not identical:
+        sys.exit(1)
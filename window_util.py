@@ -0,0 +1,86 @@
+import numpy as np
+
+from config_20XX import *
+from features import PRICE_MASK, LABEL_MASK
+
+
+# Decisions on a window are made at its last close (its last open if Close is not a feature)
+DECISION_FEATURE = FEATURES.index('Close') if 'Close' in FEATURES else 0
+
+
+# Split raw bars into consecutive windows (no copies beyond the trim)
+def window_data(stock_raw):
+    stock_raw = np.asarray(stock_raw, dtype=DTYPE)
+    r = len(stock_raw) % POINTS_PER_PERIOD
+    n = len(stock_raw) // POINTS_PER_PERIOD
+    return np.array(stock_raw[r:], copy=True).reshape(n, POINTS_PER_PERIOD, stock_raw.shape[1])
+
+
+# Window ending at every bar from POINTS_PER_PERIOD - 1 on, as a strided (read-only) view
+def sliding_windows(stock_raw):
+    stock_raw = np.asarray(stock_raw)
+    if len(stock_raw) < POINTS_PER_PERIOD:
+        return np.zeros((0, POINTS_PER_PERIOD, stock_raw.shape[1]), dtype=stock_raw.dtype)
+    windows = np.lib.stride_tricks.sliding_window_view(stock_raw, POINTS_PER_PERIOD, axis=0)
+    return windows.transpose(0, 2, 1)
+
+
+# Label every window from the windows LABEL_HORIZONS ahead of it, one column per horizon
+def window_labels(stock_dat):
+    stock_labels = np.zeros(shape=(len(stock_dat), len(LABEL_HORIZONS)), dtype=stock_dat.dtype)
+    if len(stock_dat) > 1:
+        values = BATCH_LABEL_FUNC(stock_dat if LABEL_MASK.all() else stock_dat[:, :, LABEL_MASK])
+        for j, h in enumerate(LABEL_HORIZONS):
+            stock_labels[:-h, j] = values[h:]
+    return stock_labels
+
+
+# Open and open-centred stdev (over the price features) of every window in one pass
+def window_stats(stock_dat):
+    stock_dat = np.asarray(stock_dat)
+    opens = stock_dat[:, 0, 0]
+    if not PRICE_MASK.all():
+        stock_dat = stock_dat[:, :, PRICE_MASK]
+    flat = stock_dat.reshape(stock_dat.shape[0], stock_dat.shape[1] * stock_dat.shape[2])
+    open_stdevs = np.sqrt( np.sum((flat - opens[:, None])**2, axis=1) / flat.shape[1] )
+    return opens, open_stdevs
+
+
+# Normalize windows (and labels) in place, features that are not prices are left as they are
+def normalize_windows(stock_dat, stock_labels):
+    opens, open_stdevs = window_stats(stock_dat)
+    if isinstance(stock_labels, np.ndarray):
+        stock_labels[...] = (stock_labels - opens[:, None]) / open_stdevs[:, None]
+    if PRICE_MASK.all():
+        stock_dat[...] = (stock_dat - opens[:, None, None]) / open_stdevs[:, None, None]
+    else:
+        stock_dat[:, :, PRICE_MASK] = (stock_dat[:, :, PRICE_MASK] - opens[:, None, None]) / open_stdevs[:, None, None]
+    return stock_dat
+
+
+# Unnormalize predictions (and labels) in place against the raw windows
+def unnormalize_windows(stock_raw, stock_dat, stock_labels):
+    opens, open_stdevs = window_stats(stock_raw)
+    shape = (-1,) + (1,) * (np.ndim(stock_dat) - 1)
+    stock_dat[...] = stock_dat * open_stdevs.reshape(shape) + opens.reshape(shape)
+    if isinstance(stock_labels, np.ndarray):
+        stock_labels[...] = stock_labels * open_stdevs[:, None] + opens[:, None]
+    return stock_dat, stock_labels
+
+
+# Every window's open and open-centred stdev as one (N, 2) array, what normalization divides out
+def normalization_stats(stock_raw):
+    opens, open_stdevs = window_stats(stock_raw)
+    return np.column_stack([opens, open_stdevs])
+
+
+# Normalized predictions or labels back in prices, along with the close of each window's
+# last bar, the price a decision on the window is made at. stats are the windows'
+# normalization_stats, stock_dat the normalized windows.
+def decision_prices(stock_dat, values, stats):
+    stats = np.asarray(stats, dtype=np.float64).reshape(-1, 2)
+    opens, open_stdevs = stats[:, 0], stats[:, 1]
+    values = np.asarray(values, dtype=np.float64)
+    shape = (-1,) + (1,) * (values.ndim - 1)
+    closes = np.asarray(stock_dat[:, -1, DECISION_FEATURE], dtype=np.float64) * open_stdevs + opens
+    return values * open_stdevs.reshape(shape) + opens.reshape(shape), closes